@@ -1,10 +1,10 @@
 from bs4 import BeautifulSoup
-import xml.etree.ElementTree as ET
 import os
 import json
 
 import tvlogo
 import fetcher
+import epgindex
 
 daddyLiveChannelsFileName = '247channels.html'
 daddyLiveChannelsURL = 'https://thedaddy.to/24-7-channels.php'
@@ -12,6 +12,15 @@ daddyLiveChannelsURL = 'https://thedaddy.to/24-7-channels.php'
 tvLogosFilename = 'tvlogos.html'
 tvLogosURL = 'https://github.com/tv-logo/tv-logos/tree/main/countries/united-states'
 
+# BATCH=1 auto-matches every channel without prompting; REVIEW=1 walks through the
+# ambiguous ones the batch run left in reviewFileName.
+batchMode = os.getenv('BATCH', '0') == '1'
+reviewMode = os.getenv('REVIEW', '0') == '1'
+matchThreshold = float(os.getenv('MATCH_THRESHOLD', '0.8'))
+matchMargin = float(os.getenv('MATCH_MARGIN', '0.1'))
+reviewFileName = 'match-review.json'
+grabberTvgIdsFileName = os.path.join('epgs', 'daddylive-channels-tvg-ids.txt')
+
 matches = []
 
 def search_streams(file_path, keyword):
@@ -46,43 +55,6 @@ def search_streams(file_path, keyword):
 
     return matches
 
-def search_channel_ids(file_path, search_string, idMatches):
-    """
-    Parses an XML file and finds channel tags with an id attribute that matches the search string.
-
-    Parameters:
-    file_path (str): The path to the XML file.
-    search_string (str): The string to search for within the id attribute.
-    idMatches (list): A list to store matches.
-
-    Returns:
-    list: A list of dictionaries {'id': ..., 'source': ...} that match the search string.
-    """
-    search_words = search_string.lower().split()  # Split the search string into words
-
-    try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
-        for channel in root.findall('.//channel'):
-            channel_id = channel.get('id')
-            if channel_id:
-                for word in search_words:
-                    if word in channel_id.lower():
-                        if channel_id not in [c['id'] for c in idMatches]:
-                            idMatches.append({'id': channel_id, 'source': file_path})
-                            if 'National Geographic' in channel_id:
-                                print("What")
-                        # Break if at least one word matches (prevents duplicates)
-                        break
-
-    except FileNotFoundError:
-        print(f"The file {file_path} does not exist.")
-    except ET.ParseError:
-        print(f"The file {file_path} is not a valid XML file.")
-
-    return idMatches
-
 def print_possible_ids(possibleIds, channel):
     """
     Prints the possible IDs with their indices and takes user input to make a selection.
@@ -135,9 +107,87 @@ def delete_file_if_exists(file_path):
         print(f"File {file_path} does not exist.")
         return False
 
-# Delete old files if they exist
-delete_file_if_exists('out.m3u8')
-delete_file_if_exists('tvg-ids.txt')
+def write_channel_entry(channel, channelID, logoPath, payload):
+    """
+    Appends the M3U entry for a channel to out.m3u8 and its EPG id to tvg-ids.txt.
+
+    Parameters:
+    channel (tuple): (stream number, stream name) from search_streams.
+    channelID (dict): The selected EPG id {'id': ..., 'source': ...}.
+    logoPath (str): Logo path relative to the payload's initial_path ('' for none).
+    payload (dict): The TV logos payload.
+    """
+    initialPath = payload.get('initial_path', '')
+    with open("out.m3u8", 'a', encoding='utf-8') as file:
+        file.write(
+            f"#EXTINF:-1 tvg-id=\"{channelID['id']}\" tvg-name=\"{channel[1]}\" "
+            f"tvg-logo=\"https://raw.githubusercontent.com{initialPath}{logoPath}\" "
+            f"group-title=\"USA (DADDY LIVE)\", {channel[1]}\n"
+        )
+        file.write(f"https://xyzdddd.mizhls.ru/lb/premium{channel[0]}/index.m3u8\n\n")
+
+    with open("tvg-ids.txt", 'a', encoding='utf-8') as file:
+        file.write(f"{channelID['id']}\n")
+
+def add_grabber_tvg_ids(ids):
+    """
+    Adds EPG ids to the grabber's tvg-id list, keeping existing lines and order.
+
+    Parameters:
+    ids (list): EPG ids to add.
+
+    Returns:
+    int: The number of ids that were not already listed.
+    """
+    existing = []
+    if os.path.isfile(grabberTvgIdsFileName):
+        with open(grabberTvgIdsFileName, 'r', encoding='utf-8') as file:
+            existing = [line.strip() for line in file if line.strip()]
+    known = set(existing)
+    new_ids = [i for i in dict.fromkeys(ids) if i not in known]
+    if new_ids:
+        with open(grabberTvgIdsFileName, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(existing + new_ids) + '\n')
+    return len(new_ids)
+
+def auto_match_channels(channels, epg_index, logo_index):
+    """
+    Scores EPG id and logo candidates for every channel without prompting.
+
+    Parameters:
+    channels (list): (stream number, stream name) tuples.
+    epg_index (EpgIndex): The EPG channel id index.
+    logo_index (LogoIndex): The TV logo index.
+
+    Returns:
+    tuple: (accepted, review) where accepted holds (channel, channelID, logoPath) for
+    matches above the confidence threshold and review holds the ambiguous channels
+    with their top candidates.
+    """
+    accepted = []
+    review = []
+    for channel in channels:
+        candidates = epg_index.match(channel[1])
+        logoPath = logo_index.lookup(channel[1])
+        best = candidates[0] if candidates else (0.0, None)
+        runner_up = candidates[1][0] if len(candidates) > 1 else 0.0
+        if best[0] >= matchThreshold and best[0] - runner_up >= matchMargin:
+            accepted.append((channel, best[1], logoPath))
+            continue
+        review.append({
+            'stream': channel[0],
+            'name': channel[1],
+            'epg_candidates': [dict(c, confidence=score) for score, c in candidates],
+            'logo_candidates': [{'id': {'path': path}, 'source': '', 'confidence': round(score, 3)}
+                                for score, path in logo_index.scored(channel[1])[:5]],
+        })
+    return accepted, review
+
+# Delete old files if they exist. A review pass appends to what the batch run
+# accepted instead of starting over.
+if not reviewMode:
+    delete_file_if_exists('out.m3u8')
+    delete_file_if_exists('tvg-ids.txt')
 
 # Define EPG XML files to fetch
 epgs = [
@@ -149,7 +199,7 @@ epgs = [
     {'filename': 'epgShare6.xml', 'url': 'https://epgshare01.online/epgshare01/epg_ripper_IE1.xml.gz'},
     {'filename': 'epgShare7.xml', 'url': 'https://epgshare01.online/epgshare01/epg_ripper_DE1.xml.gz'},
     {'filename': 'epgShare8.xml', 'url': 'https://epgshare01.online/epgshare01/epg_ripper_ZA1.xml.gz'},
-    {'filename': 'epgShare8.xml', 'url': 'https://epgshare01.online/epgshare01/epg_ripper_IL1.xml.gz'},
+    {'filename': 'epgShare9.xml', 'url': 'https://epgshare01.online/epgshare01/epg_ripper_IL1.xml.gz'},
     {'filename': 'bevyCustom.xml', 'url': 'https://www.bevy.be/generate/8TbvgWSctM.xml.gz'}
 ]
 
@@ -161,6 +211,10 @@ fetcher.fetchHTML(tvLogosFilename, tvLogosURL)
 for epg in epgs:
     fetcher.fetchXML(epg['filename'], epg['url'])
 
+# Index every <channel id> once (persisted, rebuilt only when an EPG file changes)
+epg_index = epgindex.load_index([epg['filename'] for epg in epgs])
+print(f"EPG index: {len(epg_index)} channel ids")
+
 # Define search terms
 search_terms = [
     # "Disney",
@@ -204,63 +258,96 @@ search_terms = [
 payload = tvlogo.extract_payload_from_file(tvLogosFilename)
 print(json.dumps(payload, indent=2))
 
-# Search the local HTML (247channels.html) for matches
-for term in search_terms:
-    search_streams(daddyLiveChannelsFileName, term)
-
-# For each matched channel in 'matches', gather EPG IDs and TV logos
-for channel in matches:
-    # Normalize the channel name for searching in EPG IDs/logos
-    word = (
-        channel[1]
-        .lower()
-        .replace('channel', '')
-        .replace('hdtv', '')
-        .replace('tv', '')
-        .replace(' hd', '')
-        .replace('2', '')
-        .replace('sports', '')
-        .replace('1', '')
-        .replace('usa', '')
-    )
-
-    possibleIds = []
-
-    user_input = int(input(f"Do you want this channel? 0 = no 1 = yes ({channel[1]}): "))
-
-    if user_input == 0:
-        continue
-    else:
-        print("Searching for matches...")
-
-    # Search for EPG IDs among the fetched epg files
-    for epg in epgs:
-        search_channel_ids(epg['filename'], word, possibleIds)
-
-    # Search for matching logos
-    logo_matches = tvlogo.search_tree_items(word, payload)
-
-    # Let the user pick the correct EPG ID
-    channelID = print_possible_ids(possibleIds, channel[1])
-
-    if channelID != -1 and channelID is not None:
-        # Let the user pick a logo (if any matches)
-        tvicon = print_possible_ids(logo_matches, channel[1])
+if batchMode:
+    # Every stream link in the local HTML, scored without any prompts
+    search_streams(daddyLiveChannelsFileName, '')
+    matches[:] = [m for m in matches if m[0].isdigit()]
+    logo_index = tvlogo.LogoIndex.from_payload(payload)
+    accepted, review = auto_match_channels(matches, epg_index, logo_index)
+
+    for channel, channelID, logoPath in accepted:
+        write_channel_entry(channel, channelID, logoPath, payload)
+    added = add_grabber_tvg_ids([channelID['id'] for _, channelID, _ in accepted])
+
+    with open(reviewFileName, 'w', encoding='utf-8') as file:
+        json.dump(review, file, indent=2, ensure_ascii=False)
+    print(f"Auto-matched {len(accepted)} channels ({added} new EPG ids for the grabber); "
+          f"{len(review)} ambiguous channels written to {reviewFileName}.")
+
+elif reviewMode:
+    # Interactive pass over the channels the batch run could not decide on; the picks
+    # are appended after the batch run's accepted entries
+    with open(reviewFileName, 'r', encoding='utf-8') as file:
+        review = json.load(file)
+    selected_ids = []
+    for entry in review:
+        channel = (entry['stream'], entry['name'])
+        matches.append(channel)
+        channelID = print_possible_ids(entry['epg_candidates'], channel[1])
+        if channelID == -1 or channelID is None:
+            continue
+        tvicon = print_possible_ids(entry['logo_candidates'], channel[1])
         if tvicon == -1 or tvicon is None:
             tvicon = {'id': {'path': ''}}
-
-        # Write the final M3U entry
-        initialPath = payload.get('initial_path', '')
-        with open("out.m3u8", 'a', encoding='utf-8') as file:
-            file.write(
-                f"#EXTINF:-1 tvg-id=\"{channelID['id']}\" tvg-name=\"{channel[1]}\" "
-                f"tvg-logo=\"https://raw.githubusercontent.com{initialPath}{tvicon['id']['path']}\" "
-                f"group-title=\"USA (DADDY LIVE)\", {channel[1]}\n"
-            )
-            file.write(f"https://xyzdddd.mizhls.ru/lb/premium{channel[0]}/index.m3u8\n\n")
-
-        # Write the final ID to tvg-ids.txt
-        with open("tvg-ids.txt", 'a', encoding='utf-8') as file:
-            file.write(f"{channelID['id']}\n")
+        write_channel_entry(channel, channelID, tvicon['id']['path'], payload)
+        selected_ids.append(channelID['id'])
+    add_grabber_tvg_ids(selected_ids)
+
+else:
+    # Search the local HTML (247channels.html) for matches
+    for term in search_terms:
+        search_streams(daddyLiveChannelsFileName, term)
+
+    # For each matched channel in 'matches', gather EPG IDs and TV logos
+    for channel in matches:
+        # Normalize the channel name for searching in EPG IDs/logos
+        word = (
+            channel[1]
+            .lower()
+            .replace('channel', '')
+            .replace('hdtv', '')
+            .replace('tv', '')
+            .replace(' hd', '')
+            .replace('2', '')
+            .replace('sports', '')
+            .replace('1', '')
+            .replace('usa', '')
+        )
+
+        user_input = int(input(f"Do you want this channel? 0 = no 1 = yes ({channel[1]}): "))
+
+        if user_input == 0:
+            continue
+        else:
+            print("Searching for matches...")
+
+        # Search for EPG IDs among the fetched epg files
+        possibleIds = epg_index.search(word)
+
+        # Search for matching logos
+        logo_matches = tvlogo.search_tree_items(word, payload)
+
+        # Let the user pick the correct EPG ID
+        channelID = print_possible_ids(possibleIds, channel[1])
+
+        if channelID != -1 and channelID is not None:
+            # Let the user pick a logo (if any matches)
+            tvicon = print_possible_ids(logo_matches, channel[1])
+            if tvicon == -1 or tvicon is None:
+                tvicon = {'id': {'path': ''}}
+
+            # Write the final M3U entry
+            initialPath = payload.get('initial_path', '')
+            with open("out.m3u8", 'a', encoding='utf-8') as file:
+                file.write(
+                    f"#EXTINF:-1 tvg-id=\"{channelID['id']}\" tvg-name=\"{channel[1]}\" "
+                    f"tvg-logo=\"https://raw.githubusercontent.com{initialPath}{tvicon['id']['path']}\" "
+                    f"group-title=\"USA (DADDY LIVE)\", {channel[1]}\n"
+                )
+                file.write(f"https://xyzdddd.mizhls.ru/lb/premium{channel[0]}/index.m3u8\n\n")
+
+            # Write the final ID to tvg-ids.txt
+            with open("tvg-ids.txt", 'a', encoding='utf-8') as file:
+                file.write(f"{channelID['id']}\n")
 
 print("Number of Streams: ", len(matches))
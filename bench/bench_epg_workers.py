@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# bench/bench_epg_workers.py
+# Compares EPG parsing with 1..N worker processes on synthetic gzipped XMLTV feeds.
+# No network: the feeds are generated into a temp dir and passed to build_epg directly.
+#
+#   python bench/bench_epg_workers.py            # FEEDS=8 CHANNELS=200 PROGRAMMES=200 MAX_PROCESSES=4
+import gzip
+import hashlib
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRABBER = os.path.join(ROOT, 'epgs', 'daddylive-channels-epg-grabber.py')
+
+FEEDS = int(os.getenv('FEEDS', '8'))
+CHANNELS = int(os.getenv('CHANNELS', '200'))
+PROGRAMMES = int(os.getenv('PROGRAMMES', '200'))
+MAX_PROCESSES = int(os.getenv('MAX_PROCESSES', str(min(os.cpu_count() or 1, 4))))
+
+def load_grabber():
+    # Registered in sys.modules so worker processes can unpickle parse_feed.
+    spec = importlib.util.spec_from_file_location('epg_grabber', GRABBER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['epg_grabber'] = module
+    spec.loader.exec_module(module)
+    return module
+
+def xmltv_time(epoch):
+    return time.strftime('%Y%m%d%H%M%S +0000', time.gmtime(epoch))
+
+def write_feed(path, feed_index, now):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n<tv>\n")
+        for c in range(CHANNELS):
+            f.write(f'  <channel id="Bench.{feed_index}.{c}.us"><display-name>Bench {c}</display-name></channel>\n')
+        start = int(now) - 12 * 3600
+        for c in range(CHANNELS):
+            for p in range(PROGRAMMES):
+                begin = start + p * 1800
+                f.write(
+                    f'  <programme start="{xmltv_time(begin)}" stop="{xmltv_time(begin + 1800)}" '
+                    f'channel="Bench.{feed_index}.{c}.us"><title lang="en">Show {p}</title>'
+                    f'<desc lang="en">Synthetic programme {p} on channel {c} of feed {feed_index}.</desc></programme>\n'
+                )
+        f.write('</tv>\n')
+
+def main():
+    grabber = load_grabber()
+    now = time.time()
+    window = (now - 6 * 3600, now + 48 * 3600)
+    with tempfile.TemporaryDirectory() as tmp:
+        feeds = []
+        valid_tvg_ids = set()
+        for i in range(FEEDS):
+            path = os.path.join(tmp, f'feed{i}.xml.gz')
+            write_feed(path, i, now)
+            feeds.append({'url': f'file://{path}', 'path': path, 'status': 'fetched', 'bytes': os.path.getsize(path), 'seconds': 0.0})
+            valid_tvg_ids.update(f'Bench.{i}.{c}.us' for c in range(0, CHANNELS, 2))
+        print(f'{FEEDS} feeds x {CHANNELS} channels x {PROGRAMMES} programmes, '
+              f'{sum(f["bytes"] for f in feeds) / 1e6:.1f} MB gzipped')
+
+        baseline = None
+        for processes in range(1, MAX_PROCESSES + 1):
+            out_path = os.path.join(tmp, f'out{processes}.xml')
+            started = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                grabber.build_epg(feeds, valid_tvg_ids, processes=processes, out_path=out_path, gz_path='', window=window)
+            elapsed = time.perf_counter() - started
+            with open(out_path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:12]
+            baseline = baseline or elapsed
+            print(f'processes={processes}: {elapsed:.2f}s (x{baseline / elapsed:.2f}) output {digest}')
+
+if __name__ == '__main__':
+    main()
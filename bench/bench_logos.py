@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# bench/bench_logos.py
+# Offline accuracy/speed check for logo matching, using tvlogos.html and the
+# hand-labelled channel names in logo_fixture.json (taken from out.m3u8).
+#
+#   python bench/bench_logos.py
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tvlogo  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo_fixture.json')
+
+def linear_pick_logo_path(display_name, payload):
+    """The original per-item substring scan from scraper.py, kept as the baseline."""
+    items = payload.get('tree', {}).get('items', [])
+    search_words = [word for word in re.split(r'[^a-zA-Z0-9]+', display_name.lower()) if word]
+    best_match = None
+    highest_score = 0
+    for item in items:
+        name_lower = item.get('name', '').lower()
+        if not any(ext in name_lower for ext in ['.png', '.svg', '.jpg']):
+            continue
+        score = sum(1 for word in search_words if word in name_lower)
+        if score > highest_score:
+            highest_score = score
+            best_match = item.get('path', '')
+    return best_match if highest_score > 0 else ''
+
+def run(name, pick, fixture, repeat):
+    correct = 0
+    misses = []
+    for case in fixture:
+        got = pick(case['name'])
+        if got == case['expected']:
+            correct += 1
+        else:
+            misses.append((case['name'], case['expected'], got))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in fixture:
+            pick(case['name'])
+    per_lookup_ms = (time.perf_counter() - start) * 1000 / (repeat * len(fixture))
+
+    print(f'{name:>8}: accuracy {correct}/{len(fixture)} ({100 * correct / len(fixture):.0f}%), '
+          f'{per_lookup_ms:.3f} ms/lookup')
+    for channel, expected, got in misses:
+        print(f'          {channel!r}: expected {expected or "-"!r}, got {got or "-"!r}')
+
+def main():
+    payload = tvlogo.extract_payload_from_file(os.path.join(ROOT, 'tvlogos.html'))
+    with open(FIXTURE, 'r', encoding='utf-8') as f:
+        fixture = json.load(f)
+
+    start = time.perf_counter()
+    index = tvlogo.LogoIndex.from_payload(payload)
+    print(f'index build: {(time.perf_counter() - start) * 1000:.1f} ms for {len(index.paths)} logos')
+
+    repeat = int(os.getenv('REPEAT', '20'))
+    run('linear', lambda n: linear_pick_logo_path(n, payload), fixture, repeat)
+    run('index', index.lookup, fixture, repeat)
+
+if __name__ == '__main__':
+    main()
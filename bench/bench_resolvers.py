@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# bench/bench_resolvers.py
+# Resolver throughput/latency benchmark against a local stand-in for the player sites.
+# No network: a threaded http.server imitates {folder}/stream-{id}.php -> iframe -> player
+# page -> .m3u8, with configurable delays and failures, and scraper.py's resolvers are
+# driven through resolve_in_order at several concurrency levels.
+#
+#   python bench/bench_resolvers.py                   # TIERS=http,selenium LEVELS=1,2,4 CHANNELS=40
+#   TIERS=http DELAY_MS=100 FAIL_RATE=0.2 python bench/bench_resolvers.py
+#
+# Channel behaviour is derived from the channel id, so every run sees the same mix:
+#   FAIL_RATE        channels whose pages always 404
+#   JS_RATIO         channels whose player builds the m3u8 URL in JS (only the browser tier finds it)
+#   LAST_FOLDER_RATIO channels that only work under the last entry of FOLDERS
+import hashlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("METRICS_FILE", "")  # keep the benchmark out of run_metrics.jsonl
+os.environ.setdefault("M3U8_WAIT", "5")    # failing channels should not dominate the run
+
+import scraper  # noqa: E402
+import runmetrics  # noqa: E402
+
+CHANNELS = int(os.getenv("CHANNELS", "40"))
+LEVELS = [int(x) for x in os.getenv("LEVELS", "1,2,4").split(",") if x.strip()]
+TIERS = [t.strip() for t in os.getenv("TIERS", "http,selenium").split(",") if t.strip()]
+FOLDERS = [f.strip() for f in os.getenv("FOLDERS", "stream,player,cast,watch,plus,casting").split(",") if f.strip()]
+DELAY_MS = float(os.getenv("DELAY_MS", "50"))
+M3U8_DELAY_MS = float(os.getenv("M3U8_DELAY_MS", "300"))
+FAIL_RATE = float(os.getenv("FAIL_RATE", "0.1"))
+JS_RATIO = float(os.getenv("JS_RATIO", "0.5"))
+LAST_FOLDER_RATIO = float(os.getenv("LAST_FOLDER_RATIO", "0.2"))
+
+def _fraction(channel_id: str, salt: str) -> float:
+    digest = hashlib.sha1(f"{salt}:{channel_id}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32
+
+def channel_profile(channel_id: str):
+    return {
+        "fails": _fraction(channel_id, "fail") < FAIL_RATE,
+        "js": _fraction(channel_id, "js") < JS_RATIO,
+        "folders": FOLDERS[-1:] if _fraction(channel_id, "folder") < LAST_FOLDER_RATIO else FOLDERS,
+    }
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, body: str = "", content_type: str = "text/html"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(DELAY_MS / 1000)
+        parts = self.path.split("?")[0].strip("/").split("/")
+        # /{folder}/stream-{id}.php -> iframe to the player page
+        if len(parts) == 2 and parts[1].startswith("stream-") and parts[1].endswith(".php"):
+            channel_id = parts[1][len("stream-"):-len(".php")]
+            profile = channel_profile(channel_id)
+            if profile["fails"] or parts[0] not in profile["folders"]:
+                return self._send(404, "not found")
+            return self._send(200, f'<html><body><iframe src="/embed/{channel_id}.html"></iframe></body></html>')
+        # /embed/{id}.html -> player page that requests the playlist
+        if len(parts) == 2 and parts[0] == "embed":
+            channel_id = parts[1].split(".")[0]
+            if channel_profile(channel_id)["js"]:
+                # Built at runtime so it never appears in the page source.
+                script = (f"setTimeout(function () {{ fetch('/hls/{channel_id}/index' + '.m3' + 'u8'); }}, {int(M3U8_DELAY_MS)});")
+            else:
+                script = f'var source = "http://{self.headers.get("Host")}/hls/{channel_id}/index.m3u8"; fetch(source);'
+            return self._send(200, f"<html><body><script>{script}</script></body></html>")
+        if len(parts) == 3 and parts[0] == "hls" and parts[2] == "index.m3u8":
+            return self._send(200, "#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4,\nseg1.ts\n",
+                              "application/vnd.apple.mpegurl")
+        return self._send(404, "not found")
+
+    def log_message(self, *args):
+        pass
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _descendants(pid: int):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    stack, seen = [pid], []
+    while stack:
+        current = stack.pop()
+        seen.append(current)
+        stack.extend(children.get(current, []))
+    return seen
+
+class RssSampler:
+    """Peak RSS of this process plus its children (chromedriver, Chrome) sampled from /proc."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, sum(_rss_kb(pid) for pid in _descendants(os.getpid())))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+def run_level(tier: str, level: int, channels):
+    scraper.CONCURRENCY = level
+    scraper.HTTP_RESOLVER = tier == "http"
+    if tier == "http":
+        # The HTTP tier alone: stop resolve_channel from falling through to a browser.
+        scraper.resolve_channel_with_selenium = lambda channel, pool=None: (channel[0], channel[1], None)
+    else:
+        scraper.resolve_channel_with_selenium = _selenium_resolver
+    scraper.FOLDER_AFFINITY.clear()
+    pool = scraper.DriverPool(level)
+    if tier == "selenium":
+        # Fail fast (and let main() skip the tier) when no Chrome/chromedriver is available.
+        pool.release(pool.acquire())
+    latencies, resolved = [], 0
+    started = time.perf_counter()
+    try:
+        with RssSampler() as rss:
+            for _, result, seconds in scraper.resolve_in_order(channels, pool, {}, None, []):
+                latencies.append(seconds)
+                if not isinstance(result, Exception) and result and result[2]:
+                    resolved += 1
+    finally:
+        pool.close()
+    elapsed = time.perf_counter() - started
+    return {
+        "tier": tier, "concurrency": level, "resolved": resolved, "channels": len(channels),
+        "seconds": elapsed, "per_minute": resolved / elapsed * 60 if elapsed else 0.0,
+        "p50": runmetrics.percentile(latencies, 50), "p90": runmetrics.percentile(latencies, 90),
+        "p99": runmetrics.percentile(latencies, 99), "peak_rss_mb": rss.peak_kb / 1024,
+    }
+
+_selenium_resolver = scraper.resolve_channel_with_selenium
+
+def main():
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    scraper.BASE_URL = base_url
+    scraper.PLAYER_FOLDERS = FOLDERS
+    channels = [(f"Bench {i}", str(1000 + i), None) for i in range(CHANNELS)]
+    expected = {tier: sum(1 for ch in channels if not channel_profile(ch[1])["fails"]
+                          and (tier == "selenium" or not channel_profile(ch[1])["js"]))
+                for tier in TIERS}
+    print(f"stand-in at {base_url}: {CHANNELS} channels, delay {DELAY_MS:.0f} ms, fail {FAIL_RATE:.0%}, "
+          f"js-only {JS_RATIO:.0%}, last-folder-only {LAST_FOLDER_RATIO:.0%}")
+    print(f"{'tier':<9}{'conc':>5}{'ok':>9}{'secs':>8}{'ch/min':>9}{'p50':>8}{'p90':>8}{'p99':>8}{'rss MB':>9}")
+    for tier in TIERS:
+        for level in LEVELS:
+            try:
+                r = run_level(tier, level, channels)
+            except Exception as e:
+                print(f"{tier:<9}{level:>5}  skipped: {type(e).__name__}: {e}")
+                break
+            print(f"{r['tier']:<9}{r['concurrency']:>5}{r['resolved']:>5}/{expected[tier]:<3}{r['seconds']:>8.2f}"
+                  f"{r['per_minute']:>9.1f}{r['p50']:>7.2f}s{r['p90']:>7.2f}s{r['p99']:>7.2f}s{r['peak_rss_mb']:>9.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
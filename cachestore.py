@@ -0,0 +1,144 @@
+# cachestore.py
+# Crash-safe storage for resolved stream entries (channel id -> stream info dict).
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+def atomic_write_text(path: str, text: str, encoding: str = 'utf-8'):
+    """
+    Writes text to a temp file in the target directory and renames it over `path`,
+    so readers (and a killed process) never see a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class JsonCacheStore:
+    """
+    Keeps the cache as a single JSON object on disk. Every put() rewrites the file
+    atomically, so progress survives a killed run at the cost of a full rewrite.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Any] = self._read()
+
+    def _read(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                print(f'[cachestore] {self.path} is not valid JSON; starting with an empty cache.')
+                return {}
+        return data if isinstance(data, dict) else {}
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._data)
+
+    def put(self, channel_id: str, entry: Any):
+        self.put_many([(channel_id, entry)])
+
+    def put_many(self, items: Iterable[Tuple[str, Any]]):
+        with self._lock:
+            for channel_id, entry in items:
+                self._data[channel_id] = entry
+            atomic_write_text(self.path, json.dumps(self._data, indent=2))
+
+    def delete(self, channel_id: str):
+        with self._lock:
+            if self._data.pop(channel_id, None) is not None:
+                atomic_write_text(self.path, json.dumps(self._data, indent=2))
+
+    def close(self):
+        pass
+
+class SqliteCacheStore:
+    """
+    One row per channel in a WAL-mode SQLite database; each put() is its own
+    small transaction, so a run can be killed at any point and resumed.
+    """
+
+    def __init__(self, path: str, import_from: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS streams ('
+            ' channel_id TEXT PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' expires_at REAL)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if import_from:
+            self.import_json(import_from)
+
+    def import_json(self, json_path: str) -> int:
+        """
+        One-time import of an existing url_cache.json. The source path is recorded
+        in the meta table so later runs do not overwrite newer rows with stale ones.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'imported_json'").fetchone()
+        if row or not os.path.exists(json_path):
+            return 0
+        data = JsonCacheStore(json_path).load()
+        self.put_many(data.items())
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_json', ?)", (json_path,))
+        print(f'[cachestore] Imported {len(data)} entries from {json_path} into {self.path}')
+        return len(data)
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute('SELECT channel_id, data FROM streams').fetchall()
+        return {channel_id: json.loads(data) for channel_id, data in rows}
+
+    def put(self, channel_id: str, entry: Any):
+        self.put_many([(channel_id, entry)])
+
+    def put_many(self, items: Iterable[Tuple[str, Any]]):
+        rows = [
+            (channel_id, json.dumps(entry), entry.get('expires_at') if isinstance(entry, dict) else None)
+            for channel_id, entry in items
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO streams (channel_id, data, expires_at) VALUES (?, ?, ?)', rows
+            )
+
+    def delete(self, channel_id: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM streams WHERE channel_id = ?', (channel_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def open_store(backend: str, json_path: str, sqlite_path: str):
+    """Returns the cache store for `backend` ('json' or 'sqlite')."""
+    backend = (backend or 'json').lower()
+    if backend == 'sqlite':
+        return SqliteCacheStore(sqlite_path, import_from=json_path)
+    if backend == 'json':
+        return JsonCacheStore(json_path)
+    raise ValueError(f'Unknown cache backend: {backend}')
@@ -0,0 +1,206 @@
+# epgindex.py
+# Index of <channel id> values across the fetched EPG files, built once and
+# persisted so channel lookups do not re-parse multi-MB XML for every channel.
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import cachestore
+import fetcher
+from tvlogo import WEAK_TOKENS, tokenize_name, trigrams
+
+INDEX_FILE = 'epg-index.json'
+INDEX_VERSION = 1
+
+# Trailing country words in DaddyLive names -> the suffix EPG ids use ('ESPN USA' -> 'ESPN.us').
+COUNTRY_SUFFIXES = {
+    'usa': 'us', 'us': 'us', 'uk': 'uk', 'england': 'uk', 'canada': 'ca', 'ca': 'ca', 'australia': 'au',
+    'au': 'au', 'ireland': 'ie', 'germany': 'de', 'de': 'de', 'spain': 'es', 'es': 'es', 'france': 'fr',
+    'fr': 'fr', 'italy': 'it', 'portugal': 'pt', 'pt': 'pt', 'netherlands': 'nl', 'nl': 'nl', 'croatia': 'hr',
+    'serbia': 'rs', 'bulgaria': 'bg', 'poland': 'pl', 'turkey': 'tr', 'greece': 'gr', 'israel': 'il',
+    'mexico': 'mx', 'brazil': 'br', 'argentina': 'ar', 'romania': 'ro', 'denmark': 'dk', 'sweden': 'se',
+    'nz': 'nz', 'malaysia': 'my', 'india': 'in', 'cyprus': 'cy', 'chile': 'cl', 'colombia': 'co',
+    'uruguay': 'uy', 'pakistan': 'pk', 'za': 'za',
+}
+COUNTRY_MATCH_BONUS = 0.1
+COUNTRY_MISMATCH_PENALTY = 0.3
+
+def split_country(display_name):
+    """'Sky Sports Main Event UK' -> ('Sky Sports Main Event', 'uk'); country is None when absent."""
+    words = display_name.split()
+    if len(words) > 1:
+        country = COUNTRY_SUFFIXES.get(words[-1].strip('()').lower())
+        if country:
+            return ' '.join(words[:-1]), country
+    return display_name, None
+
+def id_country(channel_id):
+    """'FOX.(WNYW).New.York,.NY.us' -> 'us'."""
+    head, _, tail = channel_id.rpartition('.')
+    return tail.lower() if head and tail.isalpha() and len(tail) <= 3 else None
+
+def _weighted_overlap(query, candidate):
+    def weight(token):
+        return 0.5 if token in WEAK_TOKENS else 1.0
+    union = sum(weight(t) for t in query | candidate)
+    return sum(weight(t) for t in query & candidate) / union if union else 0.0
+
+def _file_signature(path):
+    st = os.stat(path)
+    return {'mtime': st.st_mtime, 'size': st.st_size}
+
+def scan_channels(file_path):
+    """
+    Returns [{'id', 'source', 'display_names'}] for every <channel> in an XMLTV file.
+    The file is streamed with iterparse and the root is cleared after every top-level
+    element, so memory does not grow with the number of programmes.
+    """
+    channels = []
+    root = None
+    try:
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == 'channel':
+                channel_id = elem.get('id')
+                if channel_id:
+                    names = [dn.text.strip() for dn in elem.findall('display-name') if dn.text]
+                    channels.append({'id': channel_id, 'source': file_path, 'display_names': names})
+                root.clear()
+            elif elem.tag == 'programme':
+                root.clear()
+    except ET.ParseError:
+        print(f"The file {file_path} is not a valid XML file.")
+    return channels
+
+class EpgIndex:
+    """
+    Channel ids from several EPG files with a token index over ids and display names.
+    search() returns the same [{'id': ..., 'source': ...}] shape the interactive
+    script has always used, deduplicated by id.
+    """
+
+    def __init__(self, channels):
+        self.channels = []
+        self._by_id = {}
+        for channel in channels:
+            if channel['id'] not in self._by_id:
+                self._by_id[channel['id']] = len(self.channels)
+                self.channels.append(channel)
+        self.tokens = {}
+        for position, channel in enumerate(self.channels):
+            words = set(tokenize_name(channel['id']))
+            for name in channel.get('display_names', []):
+                words.update(tokenize_name(name))
+            for word in words:
+                self.tokens.setdefault(word, []).append(position)
+        self.trigrams = {}
+        for word in self.tokens:
+            for gram in trigrams(word):
+                self.trigrams.setdefault(gram, set()).add(word)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def get(self, channel_id):
+        position = self._by_id.get(channel_id)
+        return self.channels[position] if position is not None else None
+
+    def _words_for(self, query_word, fuzzy):
+        if query_word in self.tokens:
+            words = {query_word}
+        else:
+            words = set()
+        # Substring matches keep the old "word in channel_id" behaviour ('espn' -> 'espnews').
+        if len(query_word) >= 3:
+            words.update(w for w in self.tokens if query_word in w)
+        if not words and fuzzy:
+            grams = trigrams(query_word)
+            counts = {}
+            for gram in grams:
+                for word in self.trigrams.get(gram, ()):
+                    counts[word] = counts.get(word, 0) + 1
+            words.update(w for w, shared in counts.items()
+                         if shared / (len(grams) + len(trigrams(w)) - shared) >= 0.4)
+        return words
+
+    def search(self, search_string, fuzzy=True):
+        """Returns channels matching any word of search_string, best (most words matched) first."""
+        hits = {}
+        for query_word in set(tokenize_name(search_string)):
+            for word in self._words_for(query_word, fuzzy):
+                for position in self.tokens[word]:
+                    hits.setdefault(position, set()).add(query_word)
+        ranked = sorted(hits.items(), key=lambda item: (-len(item[1]), item[0]))
+        return [{'id': self.channels[p]['id'], 'source': self.channels[p]['source']} for p, _ in ranked]
+
+    def match(self, display_name, limit=5):
+        """
+        Scores EPG ids for a DaddyLive channel name and returns [(confidence, {'id', 'source'})],
+        best first. Confidence is the weighted token overlap between the name and the id (or
+        one of its display names), nudged up when the id carries the same country suffix as
+        the name and down when it carries a different one.
+        """
+        name, country = split_country(display_name)
+        query = set(tokenize_name(name))
+        if not query:
+            return []
+        scored = []
+        for candidate in self.search(name, fuzzy=False):
+            channel = self.get(candidate['id'])
+            candidate_country = id_country(channel['id'])
+            id_tokens = set(tokenize_name(channel['id']))
+            if candidate_country:
+                id_tokens.discard(candidate_country)
+            score = _weighted_overlap(query, id_tokens)
+            for dn in channel.get('display_names', []):
+                score = max(score, _weighted_overlap(query, set(tokenize_name(split_country(dn)[0]))))
+            if country and candidate_country:
+                score += COUNTRY_MATCH_BONUS if candidate_country == country else -COUNTRY_MISMATCH_PENALTY
+            scored.append((round(max(0.0, min(score, 1.0)), 3), candidate))
+        scored.sort(key=lambda item: -item[0])
+        return scored[:limit]
+
+def load_index(file_paths, index_path=INDEX_FILE):
+    """
+    Loads the persisted index, rescanning only EPG files whose size/mtime changed and
+    whose content hash differs from the one recorded, then saves it back.
+    """
+    stored = {}
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == INDEX_VERSION:
+            stored = data.get('files', {})
+    except (OSError, ValueError):
+        pass
+
+    files = {}
+    rescanned = 0
+    dirty = False
+    for path in file_paths:
+        if path in files:
+            continue
+        if not os.path.isfile(path):
+            print(f"The file {path} does not exist.")
+            continue
+        signature = _file_signature(path)
+        entry = stored.get(path)
+        if entry and entry['mtime'] == signature['mtime'] and entry['size'] == signature['size']:
+            files[path] = entry
+            continue
+        sha256 = fetcher.content_hash(path)
+        dirty = True
+        if entry and entry.get('sha256') == sha256:
+            files[path] = dict(entry, **signature)
+            continue
+        files[path] = dict(signature, sha256=sha256, channels=scan_channels(path))
+        rescanned += 1
+
+    if dirty or set(files) != set(stored):
+        cachestore.atomic_write_text(index_path, json.dumps({'version': INDEX_VERSION, 'files': files}))
+        print(f"EPG index updated ({rescanned} file(s) rescanned).")
+
+    return EpgIndex(channel for path in file_paths if path in files for channel in files[path]['channels'])
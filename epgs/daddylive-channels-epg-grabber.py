@@ -1,7 +1,22 @@
 import os
+import sys
 import gzip
+import json
+import time
+import calendar
+import zlib
+import hashlib
+import threading
+import concurrent.futures as cf
 import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The gunzip loop is shared with the top-level fetcher module.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetcher  # noqa: E402
 
 name = "daddylive-channels"
 save_as_gz = True  
@@ -13,66 +28,373 @@ tvg_ids_file = os.path.join(os.path.dirname(__file__), f"{name}-tvg-ids.txt")
 output_file = os.path.join(output_dir, f"{name}-epg.xml")
 output_file_gz = output_file + '.gz'
 
-def fetch_and_extract_xml(url):
-    response = requests.get(url)
-    if response.status_code != 200:
-        print(f"Failed to fetch {url}")
+feed_cache_dir = os.path.join(os.path.dirname(__file__), ".feed-cache")
+
+CHUNK_SIZE = 64 * 1024
+MAX_WORKERS = int(os.getenv("EPG_MAX_WORKERS", "8"))
+MAX_PER_HOST = int(os.getenv("EPG_MAX_PER_HOST", "3"))
+REQUEST_TIMEOUT = 60
+
+# Programme window relative to now; an empty value keeps everything on that side.
+PAST_HOURS = os.getenv("EPG_PAST_HOURS", "6")
+FUTURE_HOURS = os.getenv("EPG_FUTURE_HOURS", "48")
+# Keep at most this many programmes per channel (0 = no cap).
+MAX_PER_CHANNEL = int(os.getenv("EPG_MAX_PER_CHANNEL", "0"))
+# Parse feeds in this many worker processes (1 = stream them in this process).
+PARSE_PROCESSES = int(os.getenv("EPG_PROCESSES", "1"))
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(['GET']))
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def host_slot(url):
+    """Per-host semaphore so one mirror never gets more than MAX_PER_HOST parallel downloads."""
+    host = urlsplit(url).netloc
+    with _session_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+def cache_paths(url):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(feed_cache_dir, key + ".body"), os.path.join(feed_cache_dir, key + ".json")
+
+def download_feed(url):
+    """
+    Downloads a feed into the on-disk cache with a conditional GET and returns a stats
+    dict with the body path. A 304 reuses the cached body; if the request fails but an
+    older body exists, that stale copy is used rather than dropping the feed.
+    """
+    body_path, meta_path = cache_paths(url)
+    meta = {}
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    stats = {'url': url, 'path': None, 'status': 'failed', 'bytes': 0, 'seconds': 0.0}
+    started = time.time()
+    tmp_path = body_path + '.part'
+    try:
+        with host_slot(url), get_session().get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code == 304 and meta:
+                stats.update(path=body_path, status='not-modified')
+            elif response.status_code == 200:
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    # Only transport encoding is undone here; a .gz feed stays compressed on disk.
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, body_path)
+                meta = {
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'fetched_at': time.time(),
+                    'bytes': size,
+                }
+                with open(meta_path + '.part', 'w') as f:
+                    json.dump(meta, f)
+                os.replace(meta_path + '.part', meta_path)
+                stats.update(path=body_path, status='fetched', bytes=size)
+            else:
+                print(f"Failed to fetch {url}: HTTP {response.status_code}")
+    except requests.RequestException as e:
+        print(f"Failed to fetch {url}: {e}")
+        # A body cut off mid-download must not be left behind (or picked up later).
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if stats['path'] is None and meta:
+        stats.update(path=body_path, status='stale-cache')
+    stats['seconds'] = time.time() - started
+    return stats
+
+def iter_file_chunks(path):
+    """
+    Yields the XML body of a cached feed in chunks, gunzipping on the fly (every gzip
+    member, with bounded output per chunk). Whether to gunzip is decided from the gzip
+    magic bytes, not the URL, because some servers already strip the compression for us.
+    """
+    with open(path, 'rb') as f:
+        yield from fetcher.gunzip_chunks(iter(lambda: f.read(CHUNK_SIZE), b''))
+
+def iter_top_level_elements(chunks):
+    """
+    Incrementally parses XML chunks and yields each direct child of the root
+    (<channel>, <programme>) once it is complete. The element is dropped from the
+    tree as soon as the caller moves on, so memory stays bounded by one element.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield elem
+                root.clear()
+    if root is not None:
+        parser.close()
+
+_day_epochs = {}
+
+def xmltv_to_epoch(value):
+    """
+    Converts an XMLTV timestamp ('20250928010000 -0500') to epoch seconds with
+    string slicing and a per-day cache instead of full datetime parsing.
+    Returns None for values it cannot read.
+    """
+    if not value or len(value) < 12:
+        return None
+    try:
+        day = value[:8]
+        base = _day_epochs.get(day)
+        if base is None:
+            base = calendar.timegm((int(day[:4]), int(day[4:6]), int(day[6:8]), 0, 0, 0))
+            _day_epochs[day] = base
+        seconds = base + int(value[8:10]) * 3600 + int(value[10:12]) * 60 + int(value[12:14] or 0)
+        offset = value[14:].strip()
+        if len(offset) == 5:
+            delta = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+            seconds -= delta if offset[0] == '+' else -delta
+        return seconds
+    except ValueError:
         return None
 
-    if url.endswith('.gz'):
-        try:
-            decompressed_data = gzip.decompress(response.content)
-            return ET.fromstring(decompressed_data)
-        except Exception as e:
-            print(f"Failed to decompress and parse XML from {url}: {e}")
-            return None
-    else:
-        try:
-            return ET.fromstring(response.content)
-        except Exception as e:
-            print(f"Failed to parse XML from {url}: {e}")
-            return None
+def build_window(now=None):
+    """Returns (start, end) epoch bounds from PAST_HOURS/FUTURE_HOURS; None means unbounded."""
+    now = time.time() if now is None else now
+    start = now - float(PAST_HOURS) * 3600 if PAST_HOURS.strip() else None
+    end = now + float(FUTURE_HOURS) * 3600 if FUTURE_HOURS.strip() else None
+    return start, end
 
-def filter_and_build_epg(urls):
+def in_window(elem, window):
+    """True unless elem is a programme that ends before or starts after the window."""
+    start_bound, end_bound = window
+    if elem.tag != 'programme':
+        return True
+    if start_bound is not None:
+        stop = xmltv_to_epoch(elem.get('stop'))
+        if stop is not None and stop <= start_bound:
+            return False
+    if end_bound is not None:
+        start = xmltv_to_epoch(elem.get('start'))
+        if start is not None and start >= end_bound:
+            return False
+    return True
+
+def filter_element(elem, valid_tvg_ids):
+    """Returns True if elem belongs in the output, applying our title tweaks in place."""
+    if elem.tag == 'channel':
+        return elem.get('id') in valid_tvg_ids
+
+    if elem.tag == 'programme' and elem.get('channel') in valid_tvg_ids:
+        title = elem.find('title')
+        if title is None:
+            return False
+        title_text = title.text if title.text is not None else 'No title'
+        if title_text == 'NHL Hockey' or title_text == 'Live: NFL Football':
+            subtitle = elem.find('sub-title')
+            subtitle_text = subtitle.text if subtitle is not None and subtitle.text else 'No subtitle'
+            title.text = title_text + " " + subtitle_text
+        return True
+
+    return False
+
+def load_valid_tvg_ids():
     with open(tvg_ids_file, 'r') as file:
-        valid_tvg_ids = set(line.strip() for line in file)
+        return set(line.strip() for line in file)
+
+def fetch_feeds(urls):
+    """
+    Downloads the (deduplicated) feeds concurrently and yields their stats dicts in
+    the original order, so parsing of one feed overlaps with downloading the next.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if len(unique_urls) != len(urls):
+        print(f"Skipping {len(urls) - len(unique_urls)} duplicate feed url(s)")
+    os.makedirs(feed_cache_dir, exist_ok=True)
+    with cf.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        yield from executor.map(download_feed, unique_urls)
+
+class TeeWriter:
+    """
+    Sends each serialized chunk to the plain XML file and, optionally, the gzip file,
+    so the guide is serialized once. Both are written to temp files and renamed into
+    place on success, so a failed run never leaves a truncated guide behind.
+    """
+
+    def __init__(self, path, gz_path=None):
+        self.targets = [(path, path + '.part')]
+        self.sinks = [open(path + '.part', 'wb')]
+        if gz_path:
+            self.targets.append((gz_path, gz_path + '.part'))
+            self.sinks.append(gzip.open(gz_path + '.part', 'wb'))
 
-    root = ET.Element('tv')
+    def write(self, data):
+        for sink in self.sinks:
+            sink.write(data)
 
-    for url in urls:
-        print(f"Fetching xml ({url})...")
-        epg_data = fetch_and_extract_xml(url)
-        if epg_data is None:
-            continue
+    def __enter__(self):
+        return self
 
-        for channel in epg_data.findall('channel'):
-            tvg_id = channel.get('id')
-            if tvg_id in valid_tvg_ids:
-                print(f"tvg-id -> {tvg_id}")
-                root.append(channel)
+    def __exit__(self, exc_type, exc, tb):
+        for sink in self.sinks:
+            sink.close()
+        for final_path, tmp_path in self.targets:
+            if exc_type is None:
+                os.replace(tmp_path, final_path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
 
-        for programme in epg_data.findall('programme'):
-            tvg_id = programme.get('channel')
-            if tvg_id in valid_tvg_ids:
-                title = programme.find('title')
-                if title is not None:
-                    title_text = title.text if title is not None else 'No title'
+class SeenSet:
+    """Set of 64-bit digests; remembers keys without keeping the strings themselves."""
 
-                    if title_text == 'NHL Hockey' or title_text == 'Live: NFL Football':
-                        subtitle = programme.find('sub-title')
-                        subtitle_text = subtitle.text if subtitle else 'No subtitle'
-                        programme.find('title').text = title_text + " " + subtitle_text
+    def __init__(self):
+        self._digests = set()
 
-                    root.append(programme)
+    def add(self, *parts):
+        """Adds the key built from parts and returns True if it was not seen before."""
+        key = '\x1f'.join(p or '' for p in parts).encode('utf-8')
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+        if digest in self._digests:
+            return False
+        self._digests.add(digest)
+        return True
 
-    tree = ET.ElementTree(root)
-    tree.write(output_file, encoding='utf-8', xml_declaration=True)
-    print(f"New EPG saved to {output_file}")
+def iter_feed_fragments(path, valid_tvg_ids, window, counts):
+    """
+    Streams one cached feed and yields (tag, channel id, start, stop, serialized bytes)
+    for every element that passes the id filter and the time window. Pruned
+    programmes and parse errors are recorded in counts rather than raised, so a
+    broken feed keeps whatever it produced before the error.
+    """
+    counts.setdefault('out-of-window', 0)
+    try:
+        for elem in iter_top_level_elements(iter_file_chunks(path)):
+            if elem.tag == 'programme' and elem.get('channel') not in valid_tvg_ids:
+                continue
+            if not in_window(elem, window):
+                counts['out-of-window'] += 1
+                continue
+            if not filter_element(elem, valid_tvg_ids):
+                continue
+            channel_id = elem.get('id') if elem.tag == 'channel' else elem.get('channel')
+            yield elem.tag, channel_id, elem.get('start'), elem.get('stop'), ET.tostring(elem, encoding='utf-8')
+    except (ET.ParseError, zlib.error, OSError) as e:
+        counts['error'] = str(e)
 
-    if save_as_gz:
-        with gzip.open(output_file_gz, 'wb') as f:
-            tree.write(f, encoding='utf-8', xml_declaration=True)
-        print(f"New EPG saved to {output_file_gz}")
+def parse_feed(path, valid_tvg_ids, window):
+    """Process-pool worker: returns (fragments, counts) for one feed as plain bytes and tuples."""
+    counts = {}
+    fragments = list(iter_feed_fragments(path, valid_tvg_ids, window, counts))
+    return fragments, counts
+
+def iter_parsed_feeds(feeds, valid_tvg_ids, window, processes):
+    """
+    Yields (feed, fragments, counts) in feed order. With processes > 1 each feed is
+    parsed in a worker process; results are still consumed in submission order, so
+    the merged output does not depend on which worker finishes first.
+    """
+    if processes <= 1:
+        for feed in feeds:
+            counts = {}
+            fragments = iter_feed_fragments(feed['path'], valid_tvg_ids, window, counts) if feed['path'] else ()
+            yield feed, fragments, counts
+        return
+
+    with cf.ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = []
+        for feed in feeds:
+            future = pool.submit(parse_feed, feed['path'], valid_tvg_ids, window) if feed['path'] else None
+            pending.append((feed, future))
+        for feed, future in pending:
+            fragments, counts = future.result() if future else ((), {})
+            yield feed, fragments, counts
+
+def build_epg(feeds, valid_tvg_ids, processes=None, out_path=None, gz_path=None, window=None):
+    """
+    Filters the given feeds (stats dicts with a local 'path') into the output guide.
+    Deduplication and the per-channel cap are applied here, in feed order.
+    """
+    processes = PARSE_PROCESSES if processes is None else processes
+    out_path = out_path or output_file
+    if gz_path is None and save_as_gz:
+        gz_path = output_file_gz
+    window = window or build_window()
+    totals = {'fetched': 0, 'not-modified': 0, 'stale-cache': 0, 'failed': 0, 'bytes': 0,
+              'duplicates': 0, 'out-of-window': 0, 'over-cap': 0}
+    seen_channels = SeenSet()
+    seen_programmes = SeenSet()
+    per_channel = {}
+
+    with TeeWriter(out_path, gz_path) as out:
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n<tv>")
+        for feed, fragments, counts in iter_parsed_feeds(feeds, valid_tvg_ids, window, processes):
+            url = feed['url']
+            totals[feed.get('status', 'fetched')] += 1
+            totals['bytes'] += feed.get('bytes', 0)
+            print(f"Fetched xml ({url}): {feed.get('status')}, {feed.get('bytes', 0) / 1e6:.1f} MB in {feed.get('seconds', 0):.1f}s")
+            kept = 0
+            for tag, channel_id, start, stop, data in fragments:
+                if tag == 'channel':
+                    if not seen_channels.add(channel_id):
+                        totals['duplicates'] += 1
+                        continue
+                    print(f"tvg-id -> {channel_id}")
+                else:
+                    if not seen_programmes.add(channel_id, start, stop):
+                        totals['duplicates'] += 1
+                        continue
+                    if MAX_PER_CHANNEL:
+                        if per_channel.get(channel_id, 0) >= MAX_PER_CHANNEL:
+                            totals['over-cap'] += 1
+                            continue
+                        per_channel[channel_id] = per_channel.get(channel_id, 0) + 1
+                out.write(data)
+                kept += 1
+            totals['out-of-window'] += counts.get('out-of-window', 0)
+            if counts.get('error'):
+                print(f"Failed to parse XML from {url}: {counts['error']}")
+            print(f"{kept} elements kept from {url}")
+        out.write(b"</tv>")
+    print(f"New EPG saved to {out_path}")
+    if gz_path:
+        print(f"New EPG saved to {gz_path}")
+    print(f"Feeds: {totals['fetched']} downloaded ({totals['bytes'] / 1e6:.1f} MB), "
+          f"{totals['not-modified']} not modified, {totals['stale-cache']} stale cache, {totals['failed']} failed; "
+          f"{totals['duplicates']} duplicate channels/programmes dropped")
+    print(f"Pruned {totals['out-of-window']} programmes outside the window and {totals['over-cap']} over the per-channel cap")
+    return totals
+
+def filter_and_build_epg(urls):
+    return build_epg(fetch_feeds(urls), load_valid_tvg_ids())
 
 
 urls = [
@@ -91,7 +413,6 @@ urls = [
     "https://epgshare01.online/epgshare01/epg_ripper_DK1.xml.gz",
     "https://epgshare01.online/epgshare01/epg_ripper_ES1.xml.gz",
     "https://epgshare01.online/epgshare01/epg_ripper_FANDUEL1.xml.gz",
-    "https://epgshare01.online/epgshare01/epg_ripper_FANDUEL1.xml.gz",
     "https://epgshare01.online/epgshare01/epg_ripper_FR1.xml.gz",
     "https://epgshare01.online/epgshare01/epg_ripper_GR1.xml.gz",
     "https://epgshare01.online/epgshare01/epg_ripper_HR1.xml.gz",
@@ -1,10 +1,27 @@
 # fetcher.py (hardened)
-import gzip
-import io
+import hashlib
+import json
 import os
+import tempfile
+import threading
 import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CHUNK_SIZE = 1 << 16
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Per-artifact freshness: URL, validators, fetch time and content hash of every
+# downloaded file. Within max-age a file is used as-is; after that it is revalidated
+# with a conditional GET, so an unchanged page costs a 304 instead of a full body.
+MANIFEST_FILE = os.getenv("FETCH_MANIFEST", "fetch-manifest.json")
+HTML_MAX_AGE = float(os.getenv("FETCH_HTML_MAX_AGE", str(6 * 3600)))
+XML_MAX_AGE = float(os.getenv("FETCH_XML_MAX_AGE", str(12 * 3600)))
 
 DEFAULT_HEADERS = {
     "User-Agent": (
@@ -17,21 +34,42 @@ DEFAULT_HEADERS = {
     "Connection": "keep-alive",
 }
 
-def _session(timeout: float = 20.0) -> requests.Session:
-    s = requests.Session()
-    s.headers.update(DEFAULT_HEADERS)
-    s.timeout = timeout  # type: ignore[attr-defined]
-    return s
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    One pooled session for every download. Transient connection errors and 429/5xx
+    answers are retried by the adapter (honouring Retry-After) before _retry_get's
+    own loop sees them.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(["GET", "HEAD"]), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=retry)
+            s = requests.Session()
+            s.headers.update(DEFAULT_HEADERS)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
 
-def _retry_get(url: str, *, tries: int = 4, sleep: float = 1.0, allow_4xx: bool = False) -> requests.Response:
-    sess = _session()
+def _retry_get(url: str, *, tries: int = 4, sleep: float = 1.0, allow_4xx: bool = False,
+               stream: bool = False, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    sess = get_session()
     last_exc: Optional[Exception] = None
     for i in range(tries):
         try:
-            resp = sess.get(url, timeout=30)
+            resp = sess.get(url, timeout=30, stream=stream, headers=headers)
+            # 304 answers a conditional request: the copy on disk is still current
+            if resp.status_code == 304 and headers:
+                return resp
             # Accept 2xx; optionally accept 4xx if the site sometimes 403s but returns content
             if 200 <= resp.status_code < 300 or (allow_4xx and 400 <= resp.status_code < 500):
                 return resp
+            resp.close()
             print(f"[fetcher] GET {url} -> {resp.status_code}; retrying...")
         except Exception as e:
             last_exc = e
@@ -57,54 +95,203 @@ def _looks_blocked_or_tiny(text: str) -> bool:
     low = text.lower()
     return any(n in low for n in needles)
 
+@contextmanager
+def _atomic_open(filename, mode='wb', encoding=None):
+    """
+    Yields a temp file next to `filename` and renames it into place only once the
+    block finishes, so an interrupted download never leaves a truncated file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.', suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def saveFile(filename, content):
-    with open(filename, 'w', encoding='utf-8') as f:
+    with _atomic_open(filename, 'w', encoding='utf-8') as f:
         f.write(content)
 
 def saveFileAsBytes(filename, content: bytes):
-    with open(filename, 'wb') as f:
+    with _atomic_open(filename, 'wb') as f:
         f.write(content)
 
+def gunzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Gunzips a byte stream incrementally, including multi-member files. If the first
+    bytes are not the gzip magic the server already decompressed it; pass it through.
+    """
+    decompressor = None
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if decompressor is None:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk.startswith(GZIP_MAGIC) else False
+        if not decompressor:
+            yield chunk
+            continue
+        while chunk:
+            # Bounded output per call: highly compressible XML would otherwise inflate
+            # one network chunk into megabytes.
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            if data:
+                yield data
+            if decompressor.eof:
+                # Another gzip member may follow the one that just ended. Checked first:
+                # at the end of a member zlib also reports the leftover as unconsumed_tail.
+                chunk = decompressor.unused_data
+                if chunk:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                chunk = decompressor.unconsumed_tail
+    if decompressor:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
 def doesFileExist(filename):
     if os.path.isfile(filename):
         print(f'File exists, not downloading new version: {filename}')
         return True
     return False
 
-def fetchXML(filename, url):
+_manifest_lock = threading.Lock()
+
+def load_manifest() -> Dict[str, Any]:
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _update_manifest(filename: str, entry: Dict[str, Any]):
+    with _manifest_lock:
+        manifest = load_manifest()
+        manifest[filename] = entry
+        saveFile(MANIFEST_FILE, json.dumps(manifest, indent=2, sort_keys=True))
+
+def _file_sha256(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _record_fetch(filename: str, url: str, resp: requests.Response, sha256: str, max_age: float,
+                  previous: Optional[Dict[str, Any]] = None):
+    st = os.stat(filename)
+    previous = previous or {}
+    _update_manifest(filename, {
+        'url': url,
+        'etag': resp.headers.get('ETag') or previous.get('etag'),
+        'last_modified': resp.headers.get('Last-Modified') or previous.get('last_modified'),
+        'fetched_at': time.time(),
+        'max_age': max_age,
+        'sha256': sha256,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+    })
+
+def content_hash(filename: str) -> Optional[str]:
+    """
+    SHA-256 of a downloaded file. Taken from the manifest while the file's size and
+    mtime still match what was recorded, otherwise computed from disk. Downstream
+    parsers key their own caches on it to skip work when nothing changed.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    entry = load_manifest().get(filename)
+    if entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime and entry.get('sha256'):
+        return entry['sha256']
+    return _file_sha256(filename)
+
+def _check_freshness(filename: str, url: str, max_age: float):
     """
-    Downloads (and gunzips if needed) an XML file once.
+    Returns (fresh, conditional_headers, manifest_entry) for an artifact. A file with
+    no manifest entry (or one recorded for another URL) is fetched unconditionally.
     """
-    if doesFileExist(filename):
+    entry = load_manifest().get(filename)
+    if not os.path.isfile(filename) or not entry or entry.get('url') != url:
+        return False, None, None
+    if time.time() - entry.get('fetched_at', 0) < max_age:
+        return True, None, entry
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return False, headers or None, entry
+
+def _not_modified(filename: str, url: str, resp: requests.Response, max_age: float, entry: Dict[str, Any]) -> bool:
+    if resp.status_code != 304:
+        return False
+    resp.close()
+    _record_fetch(filename, url, resp, entry['sha256'], max_age, previous=entry)
+    print(f'Not modified since last download: {filename}')
+    return True
+
+def fetchXML(filename, url, max_age: float = XML_MAX_AGE):
+    """
+    Downloads (and gunzips if needed) an XML file, revalidating it once it is older
+    than max_age seconds. The body is streamed to disk in chunks, so memory use does
+    not depend on the size of the feed.
+    """
+    fresh, headers, entry = _check_freshness(filename, url, max_age)
+    if fresh:
+        print(f'File is fresh, not downloading new version: {filename}')
         return
 
-    resp = _retry_get(url, tries=4, sleep=1.0)
-    if url.endswith('.gz'):
+    resp = _retry_get(url, tries=4, sleep=1.0, stream=True, headers=headers)
+    if _not_modified(filename, url, resp, max_age, entry):
+        return
+    with resp:
+        chunks = resp.iter_content(CHUNK_SIZE)
+        if url.endswith('.gz'):
+            # Some servers already send decompressed content; gunzip_chunks falls back to raw
+            chunks = gunzip_chunks(chunks)
+        digest = hashlib.sha256()
         try:
-            # Some servers already send decompressed content; try gzip and fall back to raw
-            try:
-                data = gzip.decompress(resp.content)
-            except OSError:
-                # not actually gzipped; try as-is
-                data = resp.content
-            saveFileAsBytes(filename, data)
-        except Exception as e:
-            print(f"Failed to decompress {url}: {e}")
-    else:
-        saveFileAsBytes(filename, resp.content)
+            with _atomic_open(filename, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+        except (zlib.error, requests.RequestException) as e:
+            print(f"Failed to download {url}: {e}")
+            return
+    _record_fetch(filename, url, resp, digest.hexdigest(), max_age)
 
-def fetchHTML(filename, url):
+def fetchHTML(filename, url, max_age: float = HTML_MAX_AGE):
     """
-    Downloads an HTML page once, with UA/timeout/retries and a sanity check.
+    Downloads an HTML page, with UA/timeout/retries and a sanity check, revalidating
+    it once it is older than max_age seconds.
     """
-    if doesFileExist(filename):
+    fresh, headers, entry = _check_freshness(filename, url, max_age)
+    if fresh:
+        print(f'File is fresh, not downloading new version: {filename}')
         return
 
     # GitHub sometimes returns 4xx with useful body; allow_4xx True improves resilience
-    resp = _retry_get(url, tries=4, sleep=1.0, allow_4xx=True)
+    resp = _retry_get(url, tries=4, sleep=1.0, allow_4xx=True, headers=headers)
+    if _not_modified(filename, url, resp, max_age, entry):
+        return
     text = resp.text
 
     if _looks_blocked_or_tiny(text):
+        if os.path.isfile(filename):
+            # Keep serving the last good copy rather than failing the whole run
+            print(f"[fetcher] {url} looks blocked/empty; keeping the existing {filename}")
+            return
         # Don’t poison the cache; write a diagnostic file and raise
         diag = filename + ".blocked.html"
         saveFile(diag, text)
@@ -114,4 +301,5 @@ def fetchHTML(filename, url):
         )
 
     saveFile(filename, text)
+    _record_fetch(filename, url, resp, hashlib.sha256(text.encode('utf-8')).hexdigest(), max_age)
     print(f'Webpage downloaded and saved to {filename}')
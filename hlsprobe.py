@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# hlsprobe.py
+# Health check for the playlist scraper.py writes: fetches every entry's master
+# playlist and one media playlist with the entry's own #EXTVLCOPT headers, checks
+# that a segment is reachable and writes a JSON report.
+#
+#   python hlsprobe.py                          # probe out.m3u8 -> hls-report.json
+#   PROBE_ACTION=drop python hlsprobe.py        # also rewrite out.m3u8 without dead entries
+#   PROBE_ACTION=requeue python hlsprobe.py     # also drop dead entries from the url cache
+#                                               # so the next scraper run resolves them again
+import concurrent.futures as cf
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+import cachestore
+
+PLAYLIST = os.getenv("PROBE_PLAYLIST", "out.m3u8")
+REPORT = os.getenv("PROBE_REPORT", "hls-report.json")
+ACTION = os.getenv("PROBE_ACTION", "")  # "", "drop" or "requeue"
+CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "16"))
+TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "10"))
+CACHE_FILE = "url_cache.json"
+CACHE_DB = "url_cache.sqlite3"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "json")
+
+# Attribute lists are comma separated, but quoted values (CODECS) may contain commas.
+ATTRIBUTE_RE = re.compile(r'[A-Z0-9-]+=(?:"[^"]*"|[^,]*)')
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            sess = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=CONCURRENCY, pool_maxsize=CONCURRENCY * 2)
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            _session = sess
+        return _session
+
+def parse_playlist(path: str) -> List[Dict[str, Any]]:
+    """
+    Returns one dict per entry of an extended M3U: name, tvg_id, referer, user_agent,
+    url and the raw lines (so the playlist can be written back unchanged).
+    """
+    entries = []
+    current: Dict[str, Any] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\n")
+            stripped = line.strip()
+            if not stripped or stripped == "#EXTM3U":
+                continue
+            if stripped.startswith("#EXTINF"):
+                current = {"lines": [line], "name": stripped.rsplit(",", 1)[-1].strip(),
+                           "tvg_id": _attribute(stripped, "tvg-id"), "referer": None, "user_agent": None}
+            elif stripped.startswith("#EXTVLCOPT:http-referrer="):
+                current.setdefault("lines", []).append(line)
+                current["referer"] = stripped.split("=", 1)[1]
+            elif stripped.startswith("#EXTVLCOPT:http-user-agent="):
+                current.setdefault("lines", []).append(line)
+                current["user_agent"] = stripped.split("=", 1)[1]
+            elif stripped.startswith("#"):
+                current.setdefault("lines", []).append(line)
+            else:
+                current.setdefault("lines", []).append(line)
+                current["url"] = stripped
+                current.setdefault("name", stripped)
+                current.setdefault("tvg_id", None)
+                entries.append(current)
+                current = {}
+    return entries
+
+def _attribute(extinf: str, name: str) -> Optional[str]:
+    marker = f'{name}="'
+    start = extinf.find(marker)
+    if start == -1:
+        return None
+    start += len(marker)
+    end = extinf.find('"', start)
+    return extinf[start:end] if end != -1 else None
+
+def request_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    headers = {"User-Agent": entry.get("user_agent") or DEFAULT_USER_AGENT}
+    if entry.get("referer"):
+        headers["Referer"] = entry["referer"]
+        parts = urlsplit(entry["referer"])
+        headers["Origin"] = f"{parts.scheme}://{parts.netloc}"
+    return headers
+
+def _get_text(url: str, headers: Dict[str, str]):
+    """GET returning (status, ttfb_seconds, text); ttfb is measured to the first body byte."""
+    started = time.perf_counter()
+    with get_session().get(url, headers=headers, timeout=TIMEOUT, stream=True) as resp:
+        chunks = resp.iter_content(8192)
+        first = next(chunks, b"")
+        ttfb = time.perf_counter() - started
+        body = first + b"".join(chunks)
+    return resp.status_code, ttfb, body.decode("utf-8", "ignore")
+
+def playlist_uris(text: str) -> List[str]:
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+
+def parse_variants(text: str, base_url: str = "") -> List[Dict[str, Any]]:
+    """
+    Variants of a master playlist as [{url, bandwidth, resolution, height}], in
+    playlist order; an empty list for a media playlist.
+    """
+    variants = []
+    attributes = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            attributes = dict(
+                (key.strip().upper(), value.strip().strip('"'))
+                for key, _, value in (part.partition("=") for part in ATTRIBUTE_RE.findall(line.split(":", 1)[1]))
+            )
+        elif attributes is not None and line and not line.startswith("#"):
+            resolution = attributes.get("RESOLUTION")
+            height = resolution.lower().split("x")[-1] if resolution else ""
+            variants.append({
+                "url": urljoin(base_url, line),
+                "bandwidth": int(attributes["BANDWIDTH"]) if attributes.get("BANDWIDTH", "").isdigit() else None,
+                "resolution": resolution,
+                "height": int(height) if height.isdigit() else None,
+            })
+            attributes = None
+    return variants
+
+def first_variant(text: str) -> Optional[str]:
+    """URI of the first #EXT-X-STREAM-INF variant of a master playlist, None for a media playlist."""
+    variants = parse_variants(text)
+    return variants[0]["url"] if variants else None
+
+def probe_segment(url: str, headers: Dict[str, str]) -> Optional[int]:
+    """Status of a segment: HEAD first, a 1 KB ranged GET for CDNs that reject HEAD."""
+    sess = get_session()
+    resp = sess.head(url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
+    if resp.status_code >= 400:
+        resp = sess.get(url, headers={**headers, "Range": "bytes=0-1023"}, timeout=TIMEOUT, stream=True)
+        resp.close()
+    return resp.status_code
+
+def probe_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    result = {"name": entry.get("name"), "tvg_id": entry.get("tvg_id"), "url": entry.get("url"),
+              "alive": False, "master_status": None, "master_ttfb": None, "media_url": None,
+              "media_status": None, "media_ttfb": None, "segments": 0, "segment_status": None, "error": None}
+    headers = request_headers(entry)
+    try:
+        status, ttfb, text = _get_text(entry["url"], headers)
+        result.update(master_status=status, master_ttfb=round(ttfb, 3))
+        if status >= 400 or "#EXTM3U" not in text:
+            result["error"] = "master playlist unavailable" if status >= 400 else "not an HLS playlist"
+            return result
+
+        variant = first_variant(text)
+        media_url, media_text = entry["url"], text
+        if variant:
+            media_url = urljoin(entry["url"], variant)
+            status, ttfb, media_text = _get_text(media_url, headers)
+            result.update(media_url=media_url, media_status=status, media_ttfb=round(ttfb, 3))
+            if status >= 400:
+                result["error"] = "media playlist unavailable"
+                return result
+
+        segments = playlist_uris(media_text)
+        result["segments"] = len(segments)
+        if not segments:
+            result["error"] = "no segments"
+            return result
+        # The newest segment is the one a player would start with.
+        result["segment_status"] = probe_segment(urljoin(media_url, segments[-1]), headers)
+        result["alive"] = result["segment_status"] < 400
+        if not result["alive"]:
+            result["error"] = "segment unavailable"
+    except requests.RequestException as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+def probe_playlist(path: str = PLAYLIST, concurrency: int = CONCURRENCY) -> Dict[str, Any]:
+    entries = parse_playlist(path)
+    started = time.time()
+    with cf.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(probe_entry, entries))
+    alive = sum(1 for r in results if r["alive"])
+    return {
+        "playlist": path,
+        "generated_at": started,
+        "seconds": round(time.time() - started, 3),
+        "total": len(results),
+        "alive": alive,
+        "dead": len(results) - alive,
+        "entries": results,
+    }
+
+def drop_dead_entries(path: str, report: Dict[str, Any]) -> int:
+    """Rewrites the playlist keeping only the entries the report marks alive."""
+    entries = parse_playlist(path)
+    results = report["entries"]
+    if [e["url"] for e in entries] != [r["url"] for r in results]:
+        raise ValueError(f"{path} changed since it was probed")
+    # Matched by position: two channels can share a URL but differ in their headers.
+    kept = [e for e, r in zip(entries, results) if r["alive"]]
+    lines = ["#EXTM3U"] + [line for e in kept for line in e["lines"]]
+    cachestore.atomic_write_text(path, "\n".join(lines) + "\n")
+    return len(entries) - len(kept)
+
+def requeue_dead_entries(report: Dict[str, Any], store=None) -> List[str]:
+    """
+    Removes dead channels from the url cache; scraper.py then reports them as
+    "missing" and resolves them again on its next run.
+    """
+    store = store or cachestore.open_store(CACHE_BACKEND, CACHE_FILE, CACHE_DB)
+    requeued = []
+    try:
+        for r in report["entries"]:
+            if not r["alive"] and r["tvg_id"]:
+                store.delete(r["tvg_id"])
+                requeued.append(r["tvg_id"])
+    finally:
+        store.close()
+    return requeued
+
+def main() -> int:
+    if not os.path.exists(PLAYLIST):
+        print(f"[hlsprobe] {PLAYLIST} does not exist.")
+        return 1
+    report = probe_playlist(PLAYLIST)
+    cachestore.atomic_write_text(REPORT, json.dumps(report, indent=2))
+    print(f"[hlsprobe] {report['alive']}/{report['total']} entries alive in {report['seconds']:.1f}s; report written to {REPORT}")
+    for r in report["entries"]:
+        if not r["alive"]:
+            print(f"[hlsprobe] dead: {r['name']} ({r['error']})")
+    if ACTION == "drop":
+        print(f"[hlsprobe] Dropped {drop_dead_entries(PLAYLIST, report)} dead entries from {PLAYLIST}")
+    elif ACTION == "requeue":
+        print(f"[hlsprobe] Requeued {len(requeue_dead_entries(report))} channels for the next scraper run")
+    elif ACTION:
+        print(f"[hlsprobe] Unknown PROBE_ACTION: {ACTION}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
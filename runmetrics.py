@@ -0,0 +1,212 @@
+# runmetrics.py
+# Per-channel phase timings for scraper runs, written as JSON Lines and summarised
+# (p50/p90/p99 per phase, throughput, failure breakdown) at the end of a run.
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+METRICS_FILE = os.getenv("METRICS_FILE", "run_metrics.jsonl")
+# PROFILE=cprofile writes scraper.pstats and prints the hottest functions;
+# PROFILE=tracemalloc prints peak memory and the biggest allocation sites.
+PROFILE = os.getenv("PROFILE", "").lower()
+PROFILE_OUT = "scraper.pstats"
+
+_local = threading.local()
+
+class ChannelTrace:
+    """Phase durations (seconds, summed per phase), counters and the outcome of one channel."""
+
+    def __init__(self, channel_id: str, name: str):
+        self.channel_id = channel_id
+        self.name = name
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.counters: Counter = Counter()
+        self.tier: Optional[str] = None
+        self.folder: Optional[str] = None
+        self.outcome: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def add(self, phase_name: str, seconds: float):
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def to_record(self, run_id: str) -> Dict[str, Any]:
+        return {
+            "type": "channel",
+            "run_id": run_id,
+            "ts": round(self.started, 3),
+            "channel_id": self.channel_id,
+            "name": self.name,
+            "tier": self.tier,
+            "folder": self.folder,
+            "outcome": self.outcome,
+            "error": self.error,
+            "total": round(time.time() - self.started, 3),
+            "phases": {k: round(v, 3) for k, v in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+def current() -> Optional[ChannelTrace]:
+    return getattr(_local, "trace", None)
+
+@contextmanager
+def phase(phase_name: str):
+    """Times a block into the calling thread's channel trace; a no-op outside trace_channel."""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(phase_name, time.perf_counter() - started)
+
+def count(counter_name: str, n: int = 1):
+    trace = current()
+    if trace is not None:
+        trace.counters[counter_name] += n
+
+def annotate(**fields):
+    """Sets tier/folder/outcome/error on the calling thread's trace."""
+    trace = current()
+    if trace is not None:
+        for key, value in fields.items():
+            setattr(trace, key, value)
+
+class MetricsSink:
+    """Appends records to a JSON Lines file and keeps them for the end-of-run summary."""
+
+    def __init__(self, path: str = METRICS_FILE):
+        self.path = path
+        self.run_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self.started = time.time()
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]):
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def trace_channel(self, channel_id: str, name: str):
+        trace = ChannelTrace(channel_id, name)
+        previous, _local.trace = current(), trace
+        try:
+            yield trace
+        except BaseException as e:
+            trace.outcome = "error"
+            trace.error = trace.error or type(e).__name__
+            raise
+        finally:
+            _local.trace = previous
+            self.write(trace.to_record(self.run_id))
+
+    @contextmanager
+    def stage(self, stage_name: str):
+        """Times a run-level stage (revalidation, writing the playlist...)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.write({"type": "stage", "run_id": self.run_id, "stage": stage_name,
+                        "seconds": round(time.perf_counter() - started, 3)})
+
+    def summary(self) -> str:
+        return summarize(self.records, time.time() - self.started)
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def summarize(records: List[Dict[str, Any]], elapsed: float) -> str:
+    channels = [r for r in records if r.get("type") == "channel"]
+    lines = []
+    by_phase: Dict[str, List[float]] = {}
+    for r in channels:
+        for name, seconds in r["phases"].items():
+            by_phase.setdefault(name, []).append(seconds)
+        by_phase.setdefault("total", []).append(r["total"])
+    if by_phase:
+        lines.append(f"{'phase':<16}{'n':>6}{'p50':>9}{'p90':>9}{'p99':>9}")
+        for name, values in sorted(by_phase.items(), key=lambda item: item[0] == "total"):
+            lines.append(f"{name:<16}{len(values):>6}" + "".join(f"{percentile(values, p):>8.2f}s" for p in (50, 90, 99)))
+    for r in records:
+        if r.get("type") == "stage":
+            lines.append(f"stage {r['stage']}: {r['seconds']:.2f}s")
+    ok = sum(1 for r in channels if r["outcome"] == "ok")
+    per_minute = ok / elapsed * 60 if elapsed > 0 else 0.0
+    lines.append(f"{ok}/{len(channels)} channels resolved in {elapsed:.1f}s ({per_minute:.1f} channels/min)")
+    tiers = Counter(r["tier"] for r in channels if r["outcome"] == "ok")
+    if tiers:
+        lines.append("tiers: " + ", ".join(f"{tier}={n}" for tier, n in tiers.most_common()))
+    failures = Counter(r["error"] or r["outcome"] for r in channels if r["outcome"] != "ok")
+    if failures:
+        lines.append("failures: " + ", ".join(f"{reason}={n}" for reason, n in failures.most_common()))
+    return "\n".join(lines)
+
+@contextmanager
+def profiling(mode: str = PROFILE, out_path: str = PROFILE_OUT, top: int = 20):
+    """Optional whole-run profiler selected by PROFILE; does nothing when it is unset."""
+    if mode == "cprofile":
+        # cProfile only sees the thread that enabled it, and the resolvers run in pool
+        # workers: every thread started during the run gets its own profiler, merged at the end.
+        profilers = [cProfile.Profile()]
+        profilers_lock = threading.Lock()
+
+        def start_thread_profiler(*_):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()  # replaces this hook for the rest of the thread
+            except ValueError:
+                # Python 3.12+ profiles through sys.monitoring, which already covers every thread.
+                sys.setprofile(None)
+                return
+            with profilers_lock:
+                profilers.append(profiler)
+
+        threading.setprofile(start_thread_profiler)
+        profilers[0].enable()
+        try:
+            yield
+        finally:
+            profilers[0].disable()
+            threading.setprofile(None)
+            text = io.StringIO()
+            stats = pstats.Stats(profilers[0], stream=text)
+            with profilers_lock:
+                for profiler in profilers[1:]:
+                    stats.add(profiler)
+            stats.dump_stats(out_path)
+            stats.sort_stats("cumulative").print_stats(top)
+            print(text.getvalue())
+            print(f"[runmetrics] cProfile data for {len(profilers)} thread(s) written to {out_path}")
+    elif mode == "tracemalloc":
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"[runmetrics] peak traced memory: {peak / 1e6:.1f} MB")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"[runmetrics] {stat}")
+    else:
+        yield
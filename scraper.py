@@ -6,14 +6,27 @@ import os
 import re
 import json
 import time
-from typing import Optional, Tuple, List, Dict, Any
+import base64
+import html
+import queue
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit, parse_qs
+from typing import Optional, Tuple, List, Dict, Any, Deque
 import concurrent.futures as cf
 
 import requests
-from bs4 import BeautifulSoup
 
-# Selenium-wire'dan webdriver'ı import ediyoruz
+import cachestore
+import fetcher
+import hlsprobe
+import runmetrics
+import tvlogo
+
+# Selenium-wire'dan webdriver'ı import ediyoruz (CAPTURE_BACKEND=wire yedeği için)
 from seleniumwire import webdriver
+from selenium import webdriver as cdp_webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import TimeoutException, WebDriverException
@@ -26,228 +39,1242 @@ MAX_CHANNELS = int(os.getenv("MAX_CHANNELS", "25" if FAST_MODE else "999999"))
 CONCURRENCY = int(os.getenv("CONCURRENCY", "2" if FAST_MODE else "2"))
 FOLDERS_ENV = os.getenv("FOLDERS", "stream" if FAST_MODE else "stream,player,cast,watch,plus,casting")
 PLAYER_FOLDERS = [f.strip() for f in FOLDERS_ENV.split(",") if f.strip()]
+BASE_URL = os.getenv("BASE_URL", "https://daddylivestream.com").rstrip("/")
+HTTP_RESOLVER = os.getenv("HTTP_RESOLVER", "1") == "1"
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+MAX_IFRAME_DEPTH = int(os.getenv("MAX_IFRAME_DEPTH", "4"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(6 * 3600)))
+REVALIDATE = os.getenv("REVALIDATE", "1") == "1"
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "16"))
+# Yayın kaliteleri: MAX_BANDWIDTH (bps, 0 = sınırsız) altındaki en iyi kalite ya da RENDITION_MODE=tiers ile her kalite ayrı girdi.
+RENDITIONS = os.getenv("RENDITIONS", "1") == "1"
+MAX_BANDWIDTH = int(os.getenv("MAX_BANDWIDTH", "0"))
+RENDITION_MODE = os.getenv("RENDITION_MODE", "cap")
+# Oynatıcı klasörleri Selenium'da paralel sekmelerde yarıştırılır; önbellekte kayıtlı klasör önce tek başına denenir.
+RACE_FOLDERS = os.getenv("RACE_FOLDERS", "1") == "1"
+# "cdp": m3u8 isteği Chrome DevTools ağ olaylarından yakalanır; "wire": eski selenium-wire proxy yolu.
+CAPTURE_BACKEND = os.getenv("CAPTURE_BACKEND", "cdp").lower()
+# CDP yolunda engellenen ağır kaynaklar ve reklam/izleme alan adları (AD_HOSTS ile eklenebilir).
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.ts", "*.m4s", "*.mp4", "*.aac",
+    "*doubleclick.net*", "*googlesyndication.com*", "*google-analytics.com*", "*googletagmanager.com*",
+    "*adservice.google.*", "*popads.net*", "*propellerads*", "*adsterra*", "*histats.com*", "*exoclick.com*",
+] + [f"*{host.strip()}*" for host in os.getenv("AD_HOSTS", "").split(",") if host.strip()]
+M3U8_WAIT = int(os.getenv("M3U8_WAIT", "30"))
+AFFINITY_WAIT = int(os.getenv("AFFINITY_WAIT", "15"))
+# AUTO_CONCURRENCY=1 ise çalışan sayısı bellek, CPU yükü, gecikme ve hata oranına göre AIMD ile
+# ayarlanır; CONCURRENCY üst sınırdır.
+AUTO_CONCURRENCY = os.getenv("AUTO_CONCURRENCY", "0") == "1"
+DRIVER_MEMORY_MB = int(os.getenv("DRIVER_MEMORY_MB", "400"))
+ERROR_WINDOW = int(os.getenv("ERROR_WINDOW", "10"))
+ERROR_RATE_MARGIN = float(os.getenv("ERROR_RATE_MARGIN", "0.25"))
+# Zamanlayıcı: TIME_BUDGET (saniye, 0 = sınırsız) aşılacaksa yeni iş gönderilmez.
+TIME_BUDGET = float(os.getenv("TIME_BUDGET", "0"))
+RESOLVE_COST = float(os.getenv("RESOLVE_COST", "45"))
+MAX_FAILURES = int(os.getenv("MAX_FAILURES", "5"))
+PRIORITY = os.getenv("PRIORITY", "")
+PRIORITY_FILE = "priority.txt"
+SCHEDULE_FILE = "schedule_state.json"
+# 1 ise yalnızca önceki çalıştırmadan bu yana listeye eklenen kanallar çözümlenir.
+NEW_ONLY = os.getenv("NEW_ONLY", "0") == "1"
 
 CHANNELS_HTML = "247channels.html"
 OUT_M3U = "out.m3u8"
 CACHE_FILE = "url_cache.json"
+CACHE_DB = "url_cache.sqlite3"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "json")
 
 # =============================
 # Logo Eşleştirme Fonksiyonları
 # =============================
 def extract_payload_from_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html = f.read()
-        soup = BeautifulSoup(html, 'html.parser')
-        script_tag = soup.find('script', {'type': 'application/json', 'data-target': 'react-app.embeddedData'})
-        if not script_tag or not script_tag.string: return {}
-        data = json.loads(script_tag.string)
-        payload = data.get('payload', {})
-        repo = payload.get('repo', {})
-        owner_login = repo.get('ownerLogin') or 'tv-logo'
-        repo_name = repo.get('name') or 'tv-logos'
-        branch = payload.get('refInfo', {}).get('name') or 'main'
-        initial_path = f"/{owner_login}/{repo_name}/{branch}/"
-        payload['initial_path'] = initial_path
-        return payload
-    except Exception:
-        return {}
-
-def pick_logo_path(display_name, payload):
-    tree = payload.get("tree", {})
-    items = tree.get("items", [])
-    if not items: return ""
-
-    search_words = [word for word in re.split(r'[^a-zA-Z0-9]+', display_name.lower()) if word]
-    best_match = None
-    highest_score = 0
-
-    for item in items:
-        path = item.get("path", "")
-        name_lower = item.get("name", "").lower()
-        if not any(ext in name_lower for ext in [".png", ".svg", ".jpg"]):
-            continue
+    # Gömülü JSON regex ile bulunur ve sadeleştirilmiş logo manifesti kaynak dosyanın hash'iyle önbelleklenir.
+    return tvlogo.load_payload(file_path)
 
-        score = 0
-        for word in search_words:
-            if word in name_lower:
-                score += 1
+_logo_indexes: Dict[int, Tuple[Dict[str, Any], tvlogo.LogoIndex]] = {}
 
-        if score > highest_score:
-            highest_score = score
-            best_match = path
+def get_logo_index(payload) -> tvlogo.LogoIndex:
+    # İndeks payload başına bir kez kurulur; payload referansı tutulduğu için id() yeniden kullanılamaz.
+    cached = _logo_indexes.get(id(payload))
+    if cached is None:
+        cached = (payload, tvlogo.LogoIndex.from_payload(payload))
+        _logo_indexes[id(payload)] = cached
+    return cached[1]
 
-    return best_match if highest_score > 0 else ""
+def pick_logo_path(display_name, payload):
+    return get_logo_index(payload).lookup(display_name)
 
 # =============================
 # Ana Scraper Fonksiyonları
 # =============================
+def derive_expiry(url: str, resolved_at: Optional[float]) -> float:
+    """
+    Önbellek girdisinin son geçerlilik zamanını (epoch saniye) tahmin eder.
+    Adreste açık bir `expires`/`exp` varsa onu, yoksa `v=<epoch ms>` imzasını ya da çözümlenme anını temel alır.
+    Hiçbiri bilinmiyorsa girdi süresi dolmuş kabul edilir (0).
+    """
+    query = parse_qs(urlsplit(url).query)
+    for key in ("expires", "exp"):
+        value = (query.get(key) or [""])[0]
+        if value.isdigit() and len(value) >= 10:
+            return float(value[:10])
+    issued = resolved_at
+    version = (query.get("v") or [""])[0]
+    if version.isdigit() and len(version) >= 10:
+        issued = int(version) / 1000 if len(version) >= 13 else float(version)
+    return issued + CACHE_TTL if issued else 0.0
+
+def make_cache_entry(stream_info: Dict[str, Any], resolved_at: Optional[float] = None) -> Dict[str, Any]:
+    entry = dict(stream_info)
+    entry["resolved_at"] = resolved_at if resolved_at is not None else time.time()
+    entry["expires_at"] = derive_expiry(entry.get("url") or "", entry["resolved_at"])
+    return entry
+
+def normalize_cache_entry(value: Any) -> Optional[Dict[str, Any]]:
+    # Eski format sadece URL string'i tutuyordu; zaman damgası olmayan girdiler URL'deki `v=` imzasından tarihlenir.
+    if isinstance(value, str):
+        value = {"url": value}
+    if not isinstance(value, dict) or not value.get("url"):
+        return None
+    if "expires_at" not in value:
+        value = dict(value)
+        value.setdefault("resolved_at", 0.0)
+        value["expires_at"] = derive_expiry(value["url"], value["resolved_at"])
+    return value
+
+def is_cache_entry_fresh(entry: Dict[str, Any], now: Optional[float] = None) -> bool:
+    return entry.get("expires_at", 0) > (now if now is not None else time.time())
+
+_cache_store = None
+_cache_store_lock = threading.Lock()
+
+def get_cache_store():
+    global _cache_store
+    with _cache_store_lock:
+        if _cache_store is None:
+            _cache_store = cachestore.open_store(CACHE_BACKEND, CACHE_FILE, CACHE_DB)
+        return _cache_store
+
 def load_url_cache() -> Dict[str, Any]:
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
+    cache = {}
+    for ch_id, value in get_cache_store().load().items():
+        entry = normalize_cache_entry(value)
+        if entry:
+            cache[ch_id] = entry
+    return cache
 
 def save_url_cache(cache: Dict[str, Any]):
-    with open(CACHE_FILE, "w") as f:
-        json.dump(cache, f, indent=2)
+    get_cache_store().put_many(cache.items())
 
-def get_channels_list() -> List[Tuple[str, str, Optional[Dict[str, Any]]]]:
-    if not os.path.exists(CHANNELS_HTML):
-        print(f"'{CHANNELS_HTML}' dosyası bulunamadı.", flush=True)
-        return []
+def store_resolved_entry(channel_id: str, entry: Dict[str, Any]):
+    # Her kanal çözümlenir çözümlenmez diske yazılır; yarıda kesilen bir çalışma kaldığı yerden devam eder.
+    try:
+        get_cache_store().put(channel_id, entry)
+    except Exception as e:
+        print(f"[{channel_id}] Önbelleğe yazılamadı: {e}", flush=True)
 
-    with open(CHANNELS_HTML, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+def probe_stream(entry: Dict[str, Any]) -> bool:
+    """Önbellekteki adresi ucuz bir HEAD (gerekirse küçük bir GET) isteğiyle yoklar."""
+    headers = {}
+    if entry.get("referer"): headers["Referer"] = entry["referer"]
+    if entry.get("user_agent"): headers["User-Agent"] = entry["user_agent"]
+    sess = get_http_session()
+    try:
+        resp = sess.head(entry["url"], headers=headers, timeout=HTTP_TIMEOUT, allow_redirects=True)
+        if resp.status_code >= 400:
+            # Bazı CDN'ler HEAD desteklemiyor ya da imzayı sadece GET için kabul ediyor.
+            resp = sess.get(entry["url"], headers={**headers, "Range": "bytes=0-1023"}, timeout=HTTP_TIMEOUT, stream=True)
+            resp.close()
+        return resp.status_code < 400
+    except requests.RequestException:
+        return False
+
+def revalidate_cache(cache: Dict[str, Any], channel_ids: List[str]) -> Dict[str, str]:
+    """
+    Verilen kanalların önbellek girdilerini eşzamanlı olarak doğrular.
+    Dönen sözlük her kanal için "fresh", "expired", "dead" ya da "missing" durumunu içerir;
+    sadece "fresh" olanlar yeniden çözümlenmeden kullanılabilir.
+    """
+    now = time.time()
+    status: Dict[str, str] = {}
+    to_probe = []
+    for ch_id in channel_ids:
+        entry = cache.get(ch_id)
+        if not entry:
+            status[ch_id] = "missing"
+        elif not is_cache_entry_fresh(entry, now):
+            status[ch_id] = "expired"
+        elif not REVALIDATE:
+            status[ch_id] = "fresh"
+        else:
+            to_probe.append(ch_id)
+
+    if to_probe:
+        with cf.ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+            for ch_id, alive in zip(to_probe, executor.map(lambda c: probe_stream(cache[c]), to_probe)):
+                status[ch_id] = "fresh" if alive else "dead"
+    return status
 
-    links = soup.select("a[href*='stream-']")
+CHANNEL_LINK_RE = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\']*stream-[^"\']*)["\'][^>]*>(.*?)</a\s*>', re.I | re.S)
+CHANNEL_ID_RE = re.compile(r"stream-(\d+)\.php")
+TAG_RE = re.compile(r"<[^>]+>")
+CHANNELS_CACHE_SUFFIX = ".channels.json"
+CHANNELS_CACHE_VERSION = 1
+
+def parse_channels_html(text: str) -> List[Tuple[str, str]]:
+    # BeautifulSoup yerine tek bir derlenmiş regex geçişi: a[href*='stream-'] bağlantılarının adı ve kimliği.
     channels = []
-    for link in links:
-        href = link.get("href", "")
-        match = re.search(r"stream-(\d+)\.php", href)
+    for href, inner in CHANNEL_LINK_RE.findall(text):
+        match = CHANNEL_ID_RE.search(href)
         if match:
-            channel_id = match.group(1)
-            display_name = link.text.strip()
-            channels.append((display_name, channel_id, None))
+            channels.append((html.unescape(TAG_RE.sub("", inner)).strip(), match.group(1)))
     return channels
 
-def resolve_channel_with_selenium(channel: Tuple[str, str, Optional[Dict[str, Any]]]) -> Tuple[str, str, Optional[Dict[str, Any]]]:
-    display_name, channel_id, stream_info = channel
-    if stream_info: return channel
+def diff_channels(previous: List[Tuple[str, str]], current: List[Tuple[str, str]]) -> Dict[str, list]:
+    # Kanal kimliğine göre karşılaştırma: yeni eklenen, kaldırılan ve adı değişen kanallar.
+    old_names = {}
+    for name, ch_id in previous:
+        old_names.setdefault(ch_id, name)
+    new_names = {}
+    for name, ch_id in current:
+        new_names.setdefault(ch_id, name)
+    return {
+        "added": [ch_id for ch_id in new_names if ch_id not in old_names],
+        "removed": [ch_id for ch_id in old_names if ch_id not in new_names],
+        "renamed": [(ch_id, old_names[ch_id], name) for ch_id, name in new_names.items()
+                    if ch_id in old_names and old_names[ch_id] != name],
+    }
+
+def load_channels_with_diff() -> Tuple[List[Tuple[str, str, Optional[Dict[str, Any]]]], Optional[Dict[str, list]]]:
+    # Ayrıştırılmış liste kaynak dosyanın hash'iyle önbelleklenir; hash değişmediyse HTML hiç ayrıştırılmaz.
+    # Fark, önceki çalıştırmanın listesine göre hesaplanır; önceki liste yoksa None döner.
+    digest = fetcher.content_hash(CHANNELS_HTML)
+    if digest is None:
+        print(f"'{CHANNELS_HTML}' dosyası bulunamadı.", flush=True)
+        return [], None
+
+    cache_path = CHANNELS_HTML + CHANNELS_CACHE_SUFFIX
+    previous = None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") == CHANNELS_CACHE_VERSION:
+            previous = [tuple(ch) for ch in cached["channels"]]
+            if cached.get("source_sha256") == digest:
+                return [(name, ch_id, None) for name, ch_id in previous], diff_channels(previous, previous)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    with open(CHANNELS_HTML, "r", encoding="utf-8") as f:
+        channels = parse_channels_html(f.read())
+    try:
+        cachestore.atomic_write_text(cache_path, json.dumps(
+            {"version": CHANNELS_CACHE_VERSION, "source_sha256": digest, "channels": channels}, ensure_ascii=False))
+    except OSError as e:
+        print(f"Kanal listesi önbelleği yazılamadı ({cache_path}): {e}", flush=True)
+    diff = diff_channels(previous, channels) if previous is not None else None
+    return [(name, ch_id, None) for name, ch_id in channels], diff
 
-    player_urls = [f"https://daddylivestream.com/{folder}/stream-{channel_id}.php" for folder in PLAYER_FOLDERS]
+def get_channels_list() -> List[Tuple[str, str, Optional[Dict[str, Any]]]]:
+    return load_channels_with_diff()[0]
+
+# =============================
+# Tarayıcı Havuzu
+# =============================
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+DRIVER_MAX_USES = int(os.getenv("DRIVER_MAX_USES", "50"))
+
+_driver_path: Optional[str] = None
+_driver_path_lock = threading.Lock()
+
+def get_driver_path() -> str:
+    # ChromeDriverManager().install() her çağrıda ağa çıkıp sürüm kontrolü yapıyor; süreç başına bir kez yeterli.
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
 
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36")
-    chrome_options.add_argument('--mute-audio')
+def _chrome_options(options):
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument(f"user-agent={USER_AGENT}")
+    options.add_argument('--mute-audio')
+    # Klasör yarışı sekmeleri window.open ile açıyor; açılır pencere engeli buna izin vermez.
+    options.add_argument('--disable-popup-blocking')
+    return options
+
+def create_driver():
+    if CAPTURE_BACKEND == "cdp":
+        # Proxy yok: ağ olayları performans günlüğünden okunur. Sayfa yüklemesi beklenmez;
+        # driver.get hemen döner ve m3u8 görününce yükleme durdurulur.
+        chrome_options = _chrome_options(cdp_webdriver.ChromeOptions())
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        chrome_options.page_load_strategy = "none"
+        driver = cdp_webdriver.Chrome(service=ChromeService(get_driver_path()), options=chrome_options)
+        driver.set_page_load_timeout(40)
+        return driver
+
+    chrome_options = _chrome_options(webdriver.ChromeOptions())
 
     seleniumwire_options = {
         'suppress_connection_errors': True,
         'disable_capture': True
     }
 
-    driver = None
+    driver = webdriver.Chrome(
+        service=ChromeService(get_driver_path()),
+        options=chrome_options,
+        seleniumwire_options=seleniumwire_options
+    )
+    driver.set_page_load_timeout(40)
+    return driver
+
+def _drain_network_log(driver):
+    # Önceki kanaldan kalan performans günlüğü olaylarını atar.
     try:
-        print(f"[{display_name}] Tarayıcı (network modda) başlatılıyor...", flush=True)
-        driver = webdriver.Chrome(
-            service=ChromeService(ChromeDriverManager().install()),
-            options=chrome_options,
-            seleniumwire_options=seleniumwire_options
-        )
-        driver.set_page_load_timeout(40)
+        driver.get_log("performance")
+    except WebDriverException:
+        pass
 
-        for url in player_urls:
-            print(f"[{display_name}] URL deneniyor: {url}", flush=True)
+def _close_extra_tabs(driver):
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+
+class DriverPool:
+    """
+    Uzun ömürlü Chrome sürücüleri havuzu. Sürücüler ihtiyaç oldukça (en fazla `size` adet) açılır,
+    iade edildiğinde durumları temizlenir, çöken ya da çok kullanılan sürücüler yenilenir.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._uses: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def _is_alive(driver) -> bool:
+        try:
+            driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _discard(self, driver):
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        self._quit(driver)
+
+    def _reset(self, driver):
+        # Bir sonraki kanal temiz bir tarayıcı görsün: yakalanan istekler, çerezler ve fazla sekmeler silinir.
+        if CAPTURE_BACKEND == "cdp":
+            _drain_network_log(driver)
+        else:
+            del driver.requests
+        _close_extra_tabs(driver)
+        driver.get("about:blank")
+        try:
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        except Exception:
+            driver.delete_all_cookies()
+
+    def acquire(self):
+        with runmetrics.phase("driver_wait"):
+            self._slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._is_alive(driver):
+                    return driver
+                print("[Havuz] Çökmüş sürücü atıldı.", flush=True)
+                self._discard(driver)
+            print("[Havuz] Yeni tarayıcı (network modda) başlatılıyor...", flush=True)
+            with runmetrics.phase("driver_launch"):
+                driver = create_driver()
+            with self._lock:
+                self._uses[id(driver)] = 0
+            return driver
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver, broken: bool = False):
+        try:
+            with self._lock:
+                uses = self._uses.get(id(driver), 0) + 1
+                self._uses[id(driver)] = uses
+            if self._closed or broken or uses >= DRIVER_MAX_USES:
+                self._discard(driver)
+                return
+            try:
+                self._reset(driver)
+            except Exception as e:
+                print(f"[Havuz] Sürücü sıfırlanamadı, yenilenecek: {e}", flush=True)
+                self._discard(driver)
+                return
+            self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def trim(self, keep_idle: int) -> int:
+        # Eşzamanlılık düşürüldüğünde boşta bekleyen fazla tarayıcılar kapatılıp bellek geri verilir.
+        closed = 0
+        while self._idle.qsize() > max(0, keep_idle):
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+            closed += 1
+        return closed
+
+    def close(self):
+        self._closed = True
+        while True:
             try:
-                del driver.requests
-                driver.scopes = ['.*\\.m3u8.*']
-                
-                driver.get(url)
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+        print("[Havuz] Tüm tarayıcılar kapatıldı.", flush=True)
+
+_driver_pool: Optional[DriverPool] = None
+_driver_pool_lock = threading.Lock()
+
+def get_driver_pool() -> DriverPool:
+    global _driver_pool
+    with _driver_pool_lock:
+        if _driver_pool is None:
+            _driver_pool = DriverPool(CONCURRENCY)
+        return _driver_pool
+
+# =============================
+# Kanal Çözümleme
+# =============================
+def player_url(folder: str, channel_id: str) -> str:
+    return f"{BASE_URL}/{folder}/stream-{channel_id}.php"
 
-                hls_request = driver.wait_for_request(r'\.m3u8', timeout=30)
-                
+M3U8_RE = re.compile(r"""(https?:(?:\\?/){2}[^"'\s<>]+?\.m3u8[^"'\s<>]*)""")
+IFRAME_RE = re.compile(r"""<iframe\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+ATOB_RE = re.compile(r"""atob\(\s*["']([A-Za-z0-9+/=]{16,})["']\s*\)""")
+
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            sess = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=CONCURRENCY * 2, pool_maxsize=CONCURRENCY * 4)
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            sess.headers.update({"User-Agent": USER_AGENT, "Accept": "text/html,*/*;q=0.8"})
+            _http_session = sess
+        return _http_session
+
+def find_m3u8_in_html(html: str) -> Optional[str]:
+    match = M3U8_RE.search(html)
+    if match:
+        return match.group(1).replace("\\/", "/")
+    # Bazı oynatıcılar adresi atob("...") ile base64 olarak saklıyor.
+    for encoded in ATOB_RE.findall(html):
+        try:
+            decoded = base64.b64decode(encoded).decode("utf-8", "ignore")
+        except Exception:
+            continue
+        match = M3U8_RE.search(decoded)
+        if match:
+            return match.group(1)
+    return None
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+FOLDER_AFFINITY: Dict[str, str] = {}
+FOLDER_TRIES: Counter = Counter()
+FOLDER_WINS: Counter = Counter()
+_folder_stats_lock = threading.Lock()
+
+def load_folder_affinity(cache: Dict[str, Any]):
+    # Önbellekte hangi klasörden çözümlendiği kayıtlı kanallar, sonraki çalışmada önce o klasörü dener.
+    for ch_id, entry in cache.items():
+        if isinstance(entry, dict) and entry.get("folder") in PLAYER_FOLDERS:
+            FOLDER_AFFINITY[ch_id] = entry["folder"]
+
+def ordered_folders(channel_id: str) -> List[str]:
+    preferred = FOLDER_AFFINITY.get(channel_id)
+    if preferred in PLAYER_FOLDERS:
+        return [preferred] + [f for f in PLAYER_FOLDERS if f != preferred]
+    return list(PLAYER_FOLDERS)
+
+def _record_folder(folder: str, won: bool):
+    with _folder_stats_lock:
+        if won: FOLDER_WINS[folder] += 1
+        else: FOLDER_TRIES[folder] += 1
+
+def print_folder_stats():
+    if not FOLDER_TRIES:
+        return
+    parts = [f"{folder}={FOLDER_WINS[folder]}/{FOLDER_TRIES[folder]} (%{100 * FOLDER_WINS[folder] / FOLDER_TRIES[folder]:.0f})"
+             for folder in PLAYER_FOLDERS if FOLDER_TRIES[folder]]
+    print(f"Klasör başarıları (isabet/deneme): {', '.join(parts)}", flush=True)
+
+def resolve_channel_with_http(channel: Tuple[str, str, Optional[Dict[str, Any]]]) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """
+    Tarayıcı açmadan, oynatıcı sayfası -> iframe zincirini takip ederek m3u8 adresini sayfa kaynağında arar.
+    Bulamazsa stream_info None döner ve çağıran taraf Selenium'a düşer.
+    """
+    display_name, channel_id, stream_info = channel
+    if stream_info: return channel
+
+    sess = get_http_session()
+    for folder in ordered_folders(channel_id):
+        url = player_url(folder, channel_id)
+        referer = None
+        seen = set()
+        _record_folder(folder, won=False)
+        for _ in range(MAX_IFRAME_DEPTH + 1):
+            if url in seen:
+                break
+            seen.add(url)
+            try:
+                headers = {"Referer": referer} if referer else {}
+                with runmetrics.phase("http_fetch"):
+                    resp = sess.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            except requests.RequestException as e:
+                print(f"[{display_name}] HTTP isteği başarısız ({url}): {e}", flush=True)
+                break
+            if resp.status_code != 200:
+                break
+
+            m3u8_url = find_m3u8_in_html(resp.text)
+            if m3u8_url:
                 stream_info = {
-                    "url": hls_request.url,
-                    "referer": hls_request.headers.get('Referer'),
-                    "user_agent": hls_request.headers.get('User-Agent')
+                    "url": urljoin(url, m3u8_url),
+                    "referer": _origin(url),
+                    "user_agent": sess.headers.get("User-Agent"),
+                    "folder": folder,
                 }
+                _record_folder(folder, won=True)
+                print(f"BAŞARILI (HTTP): {display_name} ({channel_id}) -> {stream_info['url']}", flush=True)
+                return (display_name, channel_id, stream_info)
 
-                if stream_info["url"]:
-                    print(f"BAŞARILI (Network): {display_name} ({channel_id}) -> {stream_info['url']}", flush=True)
-                    return (display_name, channel_id, stream_info)
+            iframe = IFRAME_RE.search(resp.text)
+            if not iframe:
+                break
+            runmetrics.count("iframe_hops")
+            referer, url = url, urljoin(url, iframe.group(1).strip())
 
-            except TimeoutException:
-                print(f"[{display_name}] {url} adresinde m3u8 network isteği zaman aşımına uğradı.", flush=True)
+    return (display_name, channel_id, None)
+
+TIER_STATS: Counter = Counter()
+_tier_stats_lock = threading.Lock()
+
+def _record_tier(tier: str):
+    with _tier_stats_lock:
+        TIER_STATS[tier] += 1
+
+def resolve_channel(channel: Tuple[str, str, Optional[Dict[str, Any]]], pool: Optional[DriverPool] = None) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """Önce ucuz HTTP katmanını, başarısız olursa tarayıcı katmanını dener."""
+    if channel[2]: return channel
+    if HTTP_RESOLVER:
+        with runmetrics.phase("http_tier"):
+            resolved = resolve_channel_with_http(channel)
+        if resolved[2]:
+            _record_tier("http")
+            runmetrics.annotate(tier="http", folder=resolved[2].get("folder"), outcome="ok", error=None)
+            return resolved
+    with runmetrics.phase("selenium_tier"):
+        resolved = resolve_channel_with_selenium(channel, pool)
+    _record_tier("selenium" if resolved[2] else "failed")
+    if resolved[2]:
+        runmetrics.annotate(tier="selenium", folder=resolved[2].get("folder"), outcome="ok", error=None)
+    else:
+        runmetrics.annotate(tier="failed", outcome="failed")
+    return resolved
+
+def print_tier_stats():
+    total = sum(TIER_STATS.values())
+    if not total:
+        return
+    parts = [f"{tier}={TIER_STATS[tier]} (%{100 * TIER_STATS[tier] / total:.0f})" for tier in ("http", "selenium", "failed")]
+    print(f"Çözümleyici katman isabetleri: {', '.join(parts)}", flush=True)
+
+def _frame_origins(driver) -> List[str]:
+    # Sekmenin kendi adresi ve üst seviye iframe'lerin kaynakları; m3u8 isteğinin Referer'ı bunlardan birinin origin'idir.
+    try:
+        urls = driver.execute_script(
+            "return [location.href].concat(Array.from(document.querySelectorAll('iframe')).map(f => f.src));")
+    except WebDriverException:
+        return []
+    return [_origin(u) for u in urls or [] if u and u.startswith("http")]
+
+def _winning_folder(driver, tabs: List[Tuple[str, str]], referer: Optional[str]) -> Optional[str]:
+    """Yakalanan m3u8 isteğinin Referer'ına bakarak hangi sekmeden (klasörden) geldiğini bulur."""
+    if len(tabs) == 1:
+        return tabs[0][1]
+    if not referer:
+        return None
+    origin = _origin(referer)
+    for handle, folder in tabs:
+        driver.switch_to.window(handle)
+        if origin in _frame_origins(driver):
+            return folder
+    return None
+
+def _open_tabs(driver, display_name: str, channel_id: str, folders: List[str]) -> List[Tuple[str, str]]:
+    tabs: List[Tuple[str, str]] = []
+    main_handle = driver.current_window_handle
+    for folder in folders:
+        url = player_url(folder, channel_id)
+        print(f"[{display_name}] URL deneniyor: {url}", flush=True)
+        _record_folder(folder, won=False)
+        driver.switch_to.window(main_handle)
+        if CAPTURE_BACKEND == "cdp":
+            # Engelleme listesi sekme başına; sayfa açılmadan önce kurulur. page_load_strategy "none"
+            # olduğu için driver.get beklemeden döner.
+            driver.switch_to.new_window("tab")
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+            tabs.append((driver.current_window_handle, folder))
+            driver.get(url)
+            continue
+        known = set(driver.window_handles)
+        driver.execute_script("window.open(arguments[0], '_blank');", url)
+        opened = [h for h in driver.window_handles if h not in known]
+        if opened:
+            tabs.append((opened[0], folder))
+    return tabs
+
+def _wait_for_m3u8_cdp(driver, timeout: int) -> Tuple[str, Dict[str, str], Optional[str]]:
+    """
+    Performans günlüğündeki Network.requestWillBeSent olaylarını m3u8 görünene kadar okur.
+    Dönen üçlü: (url, istek başlıkları, isteği yapan sekmenin kimliği).
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for entry in driver.get_log("performance"):
+            try:
+                event = json.loads(entry["message"])
+            except (KeyError, ValueError):
                 continue
-            except WebDriverException as e:
-                print(f"[{display_name}] WebDriver hatası: {e}", flush=True)
-                break
-            except Exception as e:
-                print(f"[{display_name}] {url} işlenirken hata oluştu: {e}", flush=True)
+            message = event.get("message", {})
+            if message.get("method") != "Network.requestWillBeSent":
                 continue
+            request = message.get("params", {}).get("request", {})
+            if ".m3u8" in request.get("url", ""):
+                return request["url"], request.get("headers", {}), event.get("webview")
+        time.sleep(0.2)
+    raise TimeoutException(f"m3u8 isteği {timeout} saniye içinde görülmedi")
+
+def _race_folders(driver, display_name: str, channel_id: str, folders: List[str], timeout: int) -> Optional[Dict[str, Any]]:
+    """
+    Klasörleri ayrı sekmelerde aynı anda açar ve ilk m3u8 isteğini alır. Sekmeler yüklenmesi beklenmeden
+    açıldığı için toplam bekleme klasör sayısından bağımsız olarak en fazla `timeout` saniyedir.
+    """
+    if CAPTURE_BACKEND == "cdp":
+        _drain_network_log(driver)
+        with runmetrics.phase("page_open"):
+            tabs = _open_tabs(driver, display_name, channel_id, folders)
+        with runmetrics.phase("m3u8_wait"):
+            url, headers, webview = _wait_for_m3u8_cdp(driver, timeout)
+        # Sekme kimliği pencere tanıtıcısıyla aynıdır; iframe'den gelen isteklerde Referer'a bakılır.
+        folder = next((f for handle, f in tabs if handle == webview), None)
+        for handle, _ in tabs:
+            try:
+                driver.switch_to.window(handle)
+                driver.execute_cdp_cmd("Page.stopLoading", {})
+            except WebDriverException:
+                pass
+    else:
+        del driver.requests
+        driver.scopes = ['.*\\.m3u8.*']
+        with runmetrics.phase("page_open"):
+            tabs = _open_tabs(driver, display_name, channel_id, folders)
+        with runmetrics.phase("m3u8_wait"):
+            hls_request = driver.wait_for_request(r'\.m3u8', timeout=timeout)
+        url, headers, folder = hls_request.url, hls_request.headers, None
+
+    folder = folder or _winning_folder(driver, tabs, headers.get('Referer'))
+    if folder:
+        _record_folder(folder, won=True)
+    return {
+        "url": url,
+        "referer": headers.get('Referer'),
+        "user_agent": headers.get('User-Agent'),
+        "folder": folder,
+    }
+
+def resolve_channel_with_selenium(channel: Tuple[str, str, Optional[Dict[str, Any]]], pool: Optional[DriverPool] = None) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    display_name, channel_id, stream_info = channel
+    if stream_info: return channel
 
+    folders = ordered_folders(channel_id)
+    # Önce önbellekteki klasör kısa bir süre tek başına, sonra kalanlar birlikte yarışır.
+    # RACE_FOLDERS=0 ise eskisi gibi her klasör sırayla denenir.
+    if not RACE_FOLDERS:
+        rounds = [([folder], M3U8_WAIT) for folder in folders]
+    elif channel_id in FOLDER_AFFINITY:
+        rounds = [(folders[:1], AFFINITY_WAIT), (folders[1:], M3U8_WAIT)]
+    else:
+        rounds = [(folders, M3U8_WAIT)]
+    pool = pool or get_driver_pool()
+
+    try:
+        with pool.driver() as driver:
+            for round_folders, timeout in rounds:
+                if not round_folders:
+                    continue
+                try:
+                    stream_info = _race_folders(driver, display_name, channel_id, round_folders, timeout)
+                    if stream_info["url"]:
+                        print(f"BAŞARILI (Network): {display_name} ({channel_id}) -> {stream_info['url']}", flush=True)
+                        return (display_name, channel_id, stream_info)
+
+                except TimeoutException:
+                    runmetrics.annotate(error="m3u8_timeout")
+                    print(f"[{display_name}] {', '.join(round_folders)} klasörlerinde m3u8 network isteği zaman aşımına uğradı.", flush=True)
+                    continue
+                except WebDriverException:
+                    # Sürücü çökmüş olabilir; havuz bu sürücüyü yenilesin diye yukarı fırlatıyoruz.
+                    raise
+                except Exception as e:
+                    runmetrics.annotate(error=type(e).__name__)
+                    print(f"[{display_name}] {', '.join(round_folders)} işlenirken hata oluştu: {e}", flush=True)
+                    continue
+                finally:
+                    _close_extra_tabs(driver)
+
+    except WebDriverException as e:
+        runmetrics.annotate(error="webdriver")
+        print(f"[{display_name}] WebDriver hatası: {e}", flush=True)
     except Exception as e:
         print(f"[{display_name}] Selenium'da kritik bir hata oluştu: {e}", flush=True)
-    finally:
-        if driver:
-            driver.quit()
-            print(f"[{display_name}] Tarayıcı kapatıldı.", flush=True)
 
     print(f"BAŞARISIZ: {display_name} ({channel_id}) çözümlenemedi.", flush=True)
     return (display_name, channel_id, None)
 
+# =============================
+# Zamanlayıcı
+# =============================
+NEW_CHANNEL_WINDOW = 7 * 24 * 3600
+
+def load_priority_list() -> set:
+    # PRIORITY ortam değişkeni (virgülle ayrılmış) ve priority.txt: kanal kimlikleri ya da adları.
+    names = PRIORITY.split(",")
+    if os.path.exists(PRIORITY_FILE):
+        with open(PRIORITY_FILE, "r", encoding="utf-8") as f:
+            names += f.read().splitlines()
+    return {n.strip().lower() for n in names if n.strip()}
+
+def get_schedule_store() -> cachestore.JsonCacheStore:
+    return cachestore.JsonCacheStore(SCHEDULE_FILE)
+
+def channel_priority(channel: Tuple[str, str, Any], status: str, entry: Optional[Dict[str, Any]],
+                     stats: Dict[str, Any], priority: set, now: float) -> float:
+    """
+    Büyük olan önce çalışır. Öncelik listesi en üstte; ardından eksik/yanıt vermeyen, sonra süresi
+    en çok geçmiş kanallar gelir. Yeni eklenen kanallar ve son çalışmalarda başarısız olanlar öne alınır;
+    MAX_FAILURES kez üst üste başarısız olan kanal sona bırakılır. Geçerli kanallar içinde süresi en yakın
+    dolacak olan öndedir.
+    """
+    display_name, ch_id, _ = channel
+    score = 0.0
+    if ch_id in priority or display_name.lower() in priority:
+        score += 1000
+    if status in ("missing", "dead"):
+        score += 300
+    elif status == "expired":
+        overdue = now - (entry or {}).get("expires_at", 0)
+        score += 200 + min(overdue / 3600, 48)
+    else:
+        score -= min(((entry or {}).get("expires_at", now) - now) / 3600, 48)
+    age = now - stats.get("first_seen", now)
+    if age < NEW_CHANNEL_WINDOW:
+        score += 100 * (1 - age / NEW_CHANNEL_WINDOW)
+    failures = stats.get("failures", 0)
+    score += -500 if failures >= MAX_FAILURES else 20 * failures
+    return score
+
+def estimated_cost(stats: Dict[str, Any]) -> float:
+    return stats.get("cost") or RESOLVE_COST
+
+def record_outcome(stats: Dict[str, Any], ok: bool, seconds: float) -> Dict[str, Any]:
+    # Süre tahmini üstel ortalama ile güncellenir; başarısızlık sayacı ilk başarıda sıfırlanır.
+    stats = dict(stats)
+    stats["failures"] = 0 if ok else stats.get("failures", 0) + 1
+    stats["cost"] = round(seconds if not stats.get("cost") else 0.5 * stats["cost"] + 0.5 * seconds, 2)
+    stats["last_attempt"] = time.time()
+    return stats
+
+def _available_memory_mb() -> Optional[float]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _cpu_load() -> Optional[float]:
+    # 1 dakikalık yük ortalamasının çekirdek sayısına oranı; 1.0 tüm çekirdekler dolu demek.
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+class ConcurrencyController:
+    """
+    AIMD: bir pencere (o anki sınır kadar iş) boyunca bellek ve CPU müsaitse, gecikme başlangıçtakinin iki
+    katını geçmediyse ve hata oranı yükselmediyse sınır bir artar. Düşük bellek, aşırı CPU yükü ya da
+    WebDriver çökmesinde hemen, zaman aşımı gibi hataların son ERROR_WINDOW işteki oranı çalışmanın
+    önceki oranını ERROR_RATE_MARGIN kadar aştığında yarıya iner. Ölü kanallar bu sitede olağan olduğundan
+    tek bir zaman aşımı yük belirtisi sayılmaz. Her değişiklik `history` listesine ve loga yazılır.
+    """
+
+    def __init__(self, maximum: int, start: Optional[int] = None, adaptive: bool = True):
+        self.maximum = max(1, maximum)
+        self.adaptive = adaptive
+        self.limit = min(self.maximum, start or (2 if adaptive else self.maximum))
+        self.started = time.time()
+        self.history: List[Tuple[float, int, str]] = [(0.0, self.limit, "başlangıç")]
+        self._window = 0
+        self._cooldown = 0
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._recent: Deque[bool] = deque(maxlen=ERROR_WINDOW)
+        self._earlier_errors = 0
+        self._earlier_total = 0
+
+    def error_rate_high(self) -> Optional[str]:
+        # Önceki oran bilinene kadar (en az bir pencere) oran tek başına düşüş sebebi değildir.
+        if len(self._recent) < ERROR_WINDOW or self._earlier_total < ERROR_WINDOW:
+            return None
+        rate = sum(self._recent) / len(self._recent)
+        baseline = self._earlier_errors / self._earlier_total
+        if rate > baseline + ERROR_RATE_MARGIN:
+            return f"hata oranı %{rate * 100:.0f} (önceki %{baseline * 100:.0f})"
+        return None
+
+    def _set(self, limit: int, reason: str):
+        if limit == self.limit:
+            return
+        elapsed = time.time() - self.started
+        print(f"[Eşzamanlılık] +{elapsed:.0f} sn: {self.limit} -> {limit} ({reason})", flush=True)
+        self.limit = limit
+        self.history.append((elapsed, limit, reason))
+        self._window = 0
+
+    def pressure(self) -> Optional[str]:
+        memory = _available_memory_mb()
+        if memory is not None and memory < DRIVER_MEMORY_MB:
+            return f"boş bellek {memory:.0f} MB"
+        load = _cpu_load()
+        if load is not None and load > 1.5:
+            return f"CPU yükü {load:.2f}"
+        return None
+
+    def record(self, seconds: float, error: Optional[str], crashed: bool = False):
+        if not self.adaptive:
+            return
+        self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+        if self._baseline is None and not error:
+            self._baseline = seconds
+        # Sonuçsuz ama hatasız biten kanal (error None) siteyle ilgilidir; yükle ilgili değildir.
+        crashed = crashed or error == "webdriver"
+        if len(self._recent) == ERROR_WINDOW:
+            self._earlier_errors += self._recent[0]
+            self._earlier_total += 1
+        self._recent.append(error is not None)
+        if self._cooldown:
+            # Düşüşten önce gönderilmiş işlerin sonuçları ikinci bir düşüşe yol açmasın.
+            self._cooldown -= 1
+            return
+        self._window += 1
+        reason = self.pressure() or (f"hata: {error}" if crashed else None) or self.error_rate_high()
+        if reason:
+            previous = self.limit
+            self._set(max(1, self.limit // 2), reason)
+            self._cooldown = previous - 1
+            # Aşırı yük altındaki sonuçlar çalışmanın olağan hata oranına katılmaz.
+            self._recent.clear()
+            return
+        if self._window < self.limit:
+            return
+        memory = _available_memory_mb()
+        load = _cpu_load()
+        slow = self._baseline and self._latency and self._latency > 2 * self._baseline
+        if (self.limit < self.maximum and not slow
+                and (memory is None or memory > 2 * DRIVER_MEMORY_MB)
+                and (load is None or load < 1.0)):
+            self._set(self.limit + 1, f"{self._window} iş, ort. {self._latency:.1f} sn")
+        self._window = 0
+
+    def summary(self) -> str:
+        return ", ".join(f"+{t:.0f}sn:{limit}" for t, limit, _ in self.history)
+
+_metrics: Optional[runmetrics.MetricsSink] = None
+
+def get_metrics() -> runmetrics.MetricsSink:
+    global _metrics
+    if _metrics is None:
+        _metrics = runmetrics.MetricsSink()
+    return _metrics
+
+def _timed_resolve(channel, pool):
+    # Her kanalın aşama süreleri, katmanı, klasörü ve sonucu METRICS_FILE'a bir JSON satırı olarak yazılır.
+    started = time.time()
+    with get_metrics().trace_channel(channel[1], channel[0]) as trace:
+        resolved = resolve_channel(channel, pool)
+    # Başarılı bir kanalda ara turların (ör. m3u8_timeout) hatası eşzamanlılık ayarına yansımaz.
+    return resolved, time.time() - started, trace.error if trace.outcome != "ok" else None
+
+def resolve_in_order(channels: List[Tuple[str, str, Any]], pool: DriverPool, schedule: Dict[str, Any],
+                     deadline: Optional[float], skipped: List[Tuple[str, str, Any]],
+                     controller: Optional[ConcurrencyController] = None):
+    """
+    Kanalları verilen sırayla, aynı anda en fazla controller.limit (varsayılan CONCURRENCY) tanesi
+    çalışacak şekilde gönderir ve (kanal, sonuç ya da istisna, süre) üçlülerini tamamlandıkça üretir.
+    Bir sonraki işin tahmini maliyeti, sürmekte olan işlerle birlikte süreyi deadline'ın ötesine
+    taşıyacaksa gönderim durur; gönderilmeyen kanallar `skipped` listesine eklenir.
+    """
+    controller = controller or ConcurrencyController(CONCURRENCY, adaptive=False)
+    remaining = iter(channels)
+    with cf.ThreadPoolExecutor(max_workers=controller.maximum) as executor:
+        in_flight: Dict[cf.Future, Tuple[Tuple[str, str, Any], float]] = {}
+
+        def submit_more():
+            while len(in_flight) < controller.limit:
+                channel = next(remaining, None)
+                if channel is None:
+                    return
+                cost = estimated_cost(schedule.get(channel[1], {}))
+                pending = sum(c for _, c in in_flight.values())
+                if deadline and time.time() + (pending + cost) / controller.limit > deadline:
+                    skipped.append(channel)
+                    skipped.extend(remaining)
+                    return
+                in_flight[executor.submit(_timed_resolve, channel, pool)] = (channel, cost)
+
+        submit_more()
+        while in_flight:
+            done, _ = cf.wait(in_flight, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                channel, _ = in_flight.pop(future)
+                try:
+                    resolved, seconds, error = future.result()
+                except Exception as exc:
+                    controller.record(0.0, type(exc).__name__, crashed=True)
+                    yield channel, exc, 0.0
+                    continue
+                limit = controller.limit
+                controller.record(seconds, error)
+                if controller.limit < limit:
+                    pool.trim(controller.limit - len(in_flight))
+                yield channel, resolved, seconds
+            submit_more()
+
+# =============================
+# Yayın Kaliteleri
+# =============================
+RENDITION_PATH_RE = re.compile(r"/(?:(\d{3,4})p|(4k))/", re.I)
+# Sabit kaliteli adreslerde (.../hls/4k/playlist.m3u8) master playlist yok; aynı yolun diğer kaliteleri denenir.
+SIBLING_TIERS = [("4k", 2160), ("1080p", 1080), ("720p", 720), ("480p", 480)]
+# Segment boyutu ölçülemezse kullanılan yaklaşık bit hızları (bps).
+NOMINAL_BANDWIDTH = {2160: 16_000_000, 1080: 6_000_000, 720: 3_000_000, 480: 1_500_000}
+EXTINF_RE = re.compile(r"#EXTINF:\s*([\d.]+)")
+
+def _height_from_path(url: str) -> Optional[int]:
+    # Master playlist yoksa kaliteyi yoldan tahmin ediyoruz: .../hls/720p/... -> 720, .../hls/4k/... -> 2160
+    match = RENDITION_PATH_RE.search(url)
+    if not match:
+        return None
+    return int(match.group(1)) if match.group(1) else 2160
+
+def _get_playlist(url: str, headers: Dict[str, str]) -> Optional[requests.Response]:
+    try:
+        resp = get_http_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    except requests.RequestException:
+        return None
+    return resp if resp.status_code == 200 and "#EXTM3U" in resp.text else None
+
+def _media_bandwidth(text: str, url: str, headers: Dict[str, str]) -> Optional[int]:
+    # Ortalama bit hızı, media playlist'teki son segmentin boyutu / süresinden ölçülür.
+    durations = EXTINF_RE.findall(text)
+    segments = hlsprobe.playlist_uris(text)
+    if not durations or not segments or float(durations[-1]) <= 0:
+        return None
+    try:
+        resp = get_http_session().head(urljoin(url, segments[-1]), headers=headers, timeout=HTTP_TIMEOUT, allow_redirects=True)
+    except requests.RequestException:
+        return None
+    size = resp.headers.get("Content-Length", "")
+    if resp.status_code >= 400 or not size.isdigit():
+        return None
+    return int(int(size) * 8 / float(durations[-1]))
+
+def _sibling_renditions(url: str, text: str, headers: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Sabit kaliteli bir media playlist için aynı yoldaki diğer kaliteleri (.../4k/ -> .../1080p/ ...)
+    dener; bulunan her kalitenin bit hızı segment boyutundan ölçülür, ölçülemezse yaklaşık değer kullanılır.
+    """
+    match = RENDITION_PATH_RE.search(url)
+    own_height = _height_from_path(url)
+    if not match:
+        return [{"url": url, "bandwidth": _media_bandwidth(text, url, headers), "resolution": None, "height": own_height}]
+    renditions = []
+    for tier, height in SIBLING_TIERS:
+        tier_url = url[:match.start()] + f"/{tier}/" + url[match.end():]
+        if height == own_height:
+            tier_url, tier_text = url, text
+        else:
+            resp = _get_playlist(tier_url, headers)
+            if resp is None:
+                continue
+            tier_text = resp.text
+        bandwidth = _media_bandwidth(tier_text, tier_url, headers) or NOMINAL_BANDWIDTH[height]
+        renditions.append({"url": tier_url, "bandwidth": bandwidth, "resolution": None, "height": height})
+    if not any(r["url"] == url for r in renditions):
+        renditions.append({"url": url, "bandwidth": _media_bandwidth(text, url, headers), "resolution": None, "height": own_height})
+    return renditions
+
+def fetch_renditions(stream_info: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Kanalın playlist'ini indirip kaliteleri (url, BANDWIDTH, RESOLUTION) çıkarır.
+    Master playlist yoksa aynı yoldaki kardeş kaliteler denenir; istek başarısızsa None.
+    """
+    headers = {}
+    if stream_info.get("referer"): headers["Referer"] = stream_info["referer"]
+    if stream_info.get("user_agent"): headers["User-Agent"] = stream_info["user_agent"]
+    resp = _get_playlist(stream_info["url"], headers)
+    if resp is None:
+        return None
+    variants = hlsprobe.parse_variants(resp.text, resp.url or stream_info["url"])
+    if variants:
+        return variants
+    return _sibling_renditions(stream_info["url"], resp.text, headers)
+
+def annotate_renditions(results: List[Tuple[str, str, Any]], cache: Dict[str, Any]) -> int:
+    # Kalitesi bilinmeyen kanallar eşzamanlı yoklanır; sonuç önbelleğe de yazılır ki sonraki çalışmalar tekrar sormasın
+    # (diske, hemen ardından gelen save_url_cache ile tek seferde).
+    # Bit hızı olmayan eski kayıtlar (tek kalite, kardeş kaliteler denenmeden yazılmış) da yeniden yoklanır.
+    todo = [r for r in results if isinstance(r[2], dict)
+            and not any(rendition.get("bandwidth") for rendition in r[2].get("renditions") or [])]
+    found = 0
+    with cf.ThreadPoolExecutor(max_workers=max(1, PROBE_CONCURRENCY)) as executor:
+        for (_, ch_id, stream_info), renditions in zip(todo, executor.map(lambda r: fetch_renditions(r[2]), todo)):
+            if renditions is None:
+                continue
+            stream_info["renditions"] = renditions
+            found += 1
+            if isinstance(cache.get(ch_id), dict) and cache[ch_id].get("url") == stream_info.get("url"):
+                cache[ch_id]["renditions"] = renditions
+    return found
+
+def _rendition_label(rendition: Dict[str, Any]) -> str:
+    if rendition.get("height"):
+        return f"{rendition['height']}p"
+    if rendition.get("bandwidth"):
+        return f"{rendition['bandwidth'] // 1000} kbps"
+    return ""
+
+def select_renditions(stream_info: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    M3U'ya yazılacak (etiket, url) çiftleri. "tiers" kipinde her kalite ayrı girdi olur;
+    aksi halde MAX_BANDWIDTH altındaki en yüksek kalite (hiçbiri sığmıyorsa en düşüğü) seçilir.
+    Kalite bilgisi yoksa ya da sınır konmamışsa önbellekteki adres olduğu gibi kullanılır.
+    """
+    renditions = stream_info.get("renditions") or []
+    rated = [r for r in renditions if r.get("bandwidth")]
+    if RENDITION_MODE == "tiers" and len(renditions) > 1:
+        ordered = sorted(renditions, key=lambda r: (r.get("bandwidth") or 0, r.get("height") or 0), reverse=True)
+        return [(_rendition_label(r), r["url"]) for r in ordered]
+    if MAX_BANDWIDTH and rated:
+        fitting = [r for r in rated if r["bandwidth"] <= MAX_BANDWIDTH]
+        chosen = max(fitting, key=lambda r: r["bandwidth"]) if fitting else min(rated, key=lambda r: r["bandwidth"])
+        return [("", chosen["url"])]
+    return [("", stream_info.get("url"))]
+
 # =============================
 # Ana Çalıştırma Bloğu
 # =============================
-if __name__ == "__main__":
+def main():
     start_time = time.time()
-    
-    all_channels = get_channels_list()
-    channels_to_resolve = all_channels[:MAX_CHANNELS]
-    print(f"Toplam {len(all_channels)} kanal bulundu, {len(channels_to_resolve)} tanesi işlenecek.", flush=True)
-    
+    metrics = get_metrics()
+
+    all_channels, channel_diff = load_channels_with_diff()
+    if channel_diff is None:
+        print("Önceki kanal listesi yok; tüm kanallar yeni sayılıyor.", flush=True)
+        added_ids = {ch[1] for ch in all_channels}
+    else:
+        added_ids = set(channel_diff["added"])
+        print(f"Kanal listesi farkı: {len(channel_diff['added'])} yeni, {len(channel_diff['removed'])} kaldırılmış, "
+              f"{len(channel_diff['renamed'])} adı değişmiş.", flush=True)
+        for ch_id, old_name, new_name in channel_diff["renamed"]:
+            print(f"  Ad değişikliği ({ch_id}): {old_name} -> {new_name}", flush=True)
+
+    url_cache = load_url_cache()
+    schedule_store = get_schedule_store()
+    schedule = schedule_store.load()
+    now = time.time()
+    for ch in all_channels:
+        if ch[1] not in schedule:
+            schedule[ch[1]] = {"first_seen": now if ch[1] in added_ids else 0.0}
+    priority = load_priority_list()
+
+    def rank(ch, status):
+        return channel_priority(ch, status, url_cache.get(ch[1]), schedule.get(ch[1], {}), priority, now)
+
     payload = extract_payload_from_file("tvlogos.html")
     initial_raw_prefix = payload.get('initial_path', '')
     print(f"Logo veritabanı yüklendi. Logo kök yolu: {initial_raw_prefix}", flush=True)
 
-    url_cache = load_url_cache()
+    # Önbellekteki her kanal doğrulanır ve geçerli olanlar listeye yazılır; MAX_CHANNELS ve zaman bütçesi
+    # sadece çözümleme kuyruğuna uygulanır.
+    with metrics.stage("revalidate"):
+        cache_status = revalidate_cache(url_cache, [ch[1] for ch in all_channels])
+    load_folder_affinity(url_cache)
     resolved_from_cache = []
-    unresolved = []
-    for ch in channels_to_resolve:
+    candidates = []
+    for ch in all_channels:
         display_name, ch_id, _ = ch
-        if ch_id in url_cache: resolved_from_cache.append((display_name, ch_id, url_cache[ch_id]))
-        else: unresolved.append(ch)
-            
-    print(f"{len(resolved_from_cache)} kanal önbellekten yüklendi. {len(unresolved)} kanal çözümlenecek.", flush=True)
+        if cache_status[ch_id] == "fresh": resolved_from_cache.append((display_name, ch_id, url_cache[ch_id]))
+        elif NEW_ONLY and ch_id not in added_ids:
+            # Yalnızca yeni kanallar çözümlenir; bilinen kanallar önbellekte ne varsa onunla yazılır.
+            if ch_id in url_cache: resolved_from_cache.append((display_name, ch_id, url_cache[ch_id]))
+        else: candidates.append(ch)
+
+    # MAX_CHANNELS sınırı HTML sırasına değil önceliğe göre uygulanır; yeni ve süresi dolmuş kanallar dışarıda kalmaz.
+    # Yoklamada ölü çıkanlar da hesaba katılarak sıralanır.
+    candidates.sort(key=lambda ch: -rank(ch, cache_status[ch[1]]))
+    unresolved = candidates[:MAX_CHANNELS]
+    # Sınırın dışında kalan kanalların süresi dolmuş adresleri listede kalır; hâlâ çalışıyor olabilirler.
+    resolved_from_cache.extend((ch[0], ch[1], url_cache[ch[1]]) for ch in candidates[MAX_CHANNELS:]
+                               if cache_status[ch[1]] == "expired")
+
+    status_counts = Counter(cache_status.values())
+    print(f"Toplam {len(all_channels)} kanal bulundu, {len(unresolved)} tanesi çözümlenecek.", flush=True)
+    print(f"Önbellek doğrulaması: {status_counts['fresh']} geçerli, {status_counts['expired']} süresi dolmuş, "
+          f"{status_counts['dead']} yanıt vermeyen, {status_counts['missing']} eksik.", flush=True)
+    print(f"{len(resolved_from_cache)} kanal önbellekten yüklendi.", flush=True)
+
+    deadline = start_time + TIME_BUDGET if TIME_BUDGET > 0 else None
 
     results = resolved_from_cache
-    with cf.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
-        future_to_channel = {executor.submit(resolve_channel_with_selenium, ch): ch for ch in unresolved}
-        for future in cf.as_completed(future_to_channel):
-            channel = future_to_channel[future]
-            try:
-                resolved_channel = future.result()
-                if resolved_channel:
+    skipped: List[Tuple[str, str, Any]] = []
+    pool = get_driver_pool()
+    controller = ConcurrencyController(CONCURRENCY, adaptive=AUTO_CONCURRENCY)
+    with metrics.stage("resolve"):
+        try:
+            for channel, resolved_channel, seconds in resolve_in_order(unresolved, pool, schedule, deadline, skipped, controller):
+                if isinstance(resolved_channel, Exception):
+                    print(f'{channel[0]} oluşturulurken bir istisna oluştu: {resolved_channel}', flush=True)
+                    schedule[channel[1]] = record_outcome(schedule.get(channel[1], {}), False, seconds)
+                    if cache_status[channel[1]] == "expired":
+                        results.append((channel[0], channel[1], url_cache[channel[1]]))
+                    continue
+                ok = bool(resolved_channel and resolved_channel[2])
+                schedule[channel[1]] = record_outcome(schedule.get(channel[1], {}), ok, seconds)
+                if not ok and cache_status[channel[1]] == "expired":
+                    # Çözümlenemeyen kanalın süresi dolmuş adresi de listede kalır.
+                    results.append((channel[0], channel[1], url_cache[channel[1]]))
+                elif resolved_channel:
                     results.append(resolved_channel)
-                    if resolved_channel[2]: url_cache[resolved_channel[1]] = resolved_channel[2]
-            except Exception as exc:
-                print(f'{channel[0]} oluşturulurken bir istisna oluştu: {exc}', flush=True)
+                    if resolved_channel[2]:
+                        url_cache[resolved_channel[1]] = make_cache_entry(resolved_channel[2])
+                        store_resolved_entry(resolved_channel[1], url_cache[resolved_channel[1]])
+        finally:
+            pool.close()
+            schedule_store.put_many(schedule.items())
+    print_tier_stats()
+    print_folder_stats()
+    if AUTO_CONCURRENCY:
+        print(f"Eşzamanlılık geçmişi (üst sınır {CONCURRENCY}): {controller.summary()}", flush=True)
+    if skipped:
+        print(f"Zaman bütçesi ({TIME_BUDGET:.0f} sn) nedeniyle {len(skipped)} kanal bu çalışmada atlandı.", flush=True)
+        # Atlanan kanalların süresi dolmuş adresleri listede kalır; hâlâ çalışıyor olabilirler.
+        results.extend((ch[0], ch[1], url_cache[ch[1]]) for ch in skipped if cache_status[ch[1]] == "expired")
+
+    if RENDITIONS:
+        with metrics.stage("renditions"):
+            print(f"{annotate_renditions(results, url_cache)} kanalın kalite listesi güncellendi.", flush=True)
 
     save_url_cache(url_cache)
+    get_cache_store().close()
 
     results_sorted = sorted([r for r in results if r and r[2]], key=lambda r: r[0])
     
-    with open(OUT_M3U, "w", encoding="utf-8") as out:
-        out.write("#EXTM3U\n")
-        for display_name, ch_id, stream_info in results_sorted:
-            logo_path = pick_logo_path(display_name, payload)
-            logo_url = f"https://raw.githubusercontent.com{initial_raw_prefix}{logo_path}" if logo_path else ""
-            
-            out.write(
-                f'#EXTINF:-1 tvg-id="{ch_id}" tvg-name="{display_name}" tvg-logo="{logo_url}" '
-                f'group-title="Daddylive", {display_name}\n'
-            )
+    with metrics.stage("write_m3u"):
+        with open(OUT_M3U, "w", encoding="utf-8") as out:
+            out.write("#EXTM3U\n")
+            for display_name, ch_id, stream_info in results_sorted:
+                logo_path = pick_logo_path(display_name, payload)
+                logo_url = f"https://raw.githubusercontent.com{initial_raw_prefix}{logo_path}" if logo_path else ""
             
-            # Hem eski (string) hem de yeni (dict) cache formatını kontrol ediyoruz
-            if isinstance(stream_info, dict):
-                # Yeni format: Başlıkları ve URL'i yaz
-                if stream_info.get('referer'):
-                    out.write(f'#EXTVLCOPT:http-referrer={stream_info["referer"]}\n')
-                if stream_info.get('user_agent'):
-                    out.write(f'#EXTVLCOPT:http-user-agent={stream_info["user_agent"]}\n')
-                out.write(f'{stream_info.get("url")}\n')
-            elif isinstance(stream_info, str):
-                # Eski format: Sadece URL'i yaz
-                out.write(f'{stream_info}\n')
-
+                # Hem eski (string) hem de yeni (dict) cache formatını kontrol ediyoruz
+                if isinstance(stream_info, dict):
+                    # Yeni format: seçilen her kalite için başlıkları ve URL'i yaz
+                    for label, url in select_renditions(stream_info):
+                        name = f"{display_name} ({label})" if label else display_name
+                        out.write(
+                            f'#EXTINF:-1 tvg-id="{ch_id}" tvg-name="{name}" tvg-logo="{logo_url}" '
+                            f'group-title="Daddylive", {name}\n'
+                        )
+                        if stream_info.get('referer'):
+                            out.write(f'#EXTVLCOPT:http-referrer={stream_info["referer"]}\n')
+                        if stream_info.get('user_agent'):
+                            out.write(f'#EXTVLCOPT:http-user-agent={stream_info["user_agent"]}\n')
+                        out.write(f'{url}\n')
+                elif isinstance(stream_info, str):
+                    # Eski format: Sadece URL'i yaz
+                    out.write(
+                        f'#EXTINF:-1 tvg-id="{ch_id}" tvg-name="{display_name}" tvg-logo="{logo_url}" '
+                        f'group-title="Daddylive", {display_name}\n'
+                    )
+                    out.write(f'{stream_info}\n')
 
     end_time = time.time()
     print(f"İşlem tamamlandı. {len(results_sorted)} kanal '{OUT_M3U}' dosyasına yazıldı.", flush=True)
     print(f"Toplam süre: {end_time - start_time:.2f} saniye.", flush=True)
+    print(metrics.summary(), flush=True)
+    if metrics.path:
+        print(f"Kanal bazlı ölçümler '{metrics.path}' dosyasına eklendi.", flush=True)
+
+if __name__ == "__main__":
+    # PROFILE=cprofile ya da PROFILE=tracemalloc tüm çalışmayı profiller.
+    with runmetrics.profiling():
+        main()
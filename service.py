@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# service.py
+# Resident mode for scraper.py: instead of a cron run rewriting out.m3u8, channels are
+# resolved on demand and kept warm in memory.
+#
+#   GET /playlist.m3u8          every channel, pointing at /channel/{id}.m3u8 on this server
+#                               (?direct=1 lists cached upstream URLs with #EXTVLCOPT headers)
+#   GET /channel/{id}.m3u8      resolves on first request, then serves the upstream playlist;
+#                               concurrent requests share one resolve
+#   GET /proxy/{id}?url=&sig=   variant playlists and segments, fetched with the Referer,
+#                               Origin and User-Agent the channel was resolved with
+#   GET /health                 cache and resolver counters as JSON
+#
+# With SERVICE_PROXY=0 playlists point straight at the CDN instead; that only plays
+# from CDNs that do not check those headers.
+#
+#   SERVICE_PORT=8080 python service.py
+import concurrent.futures as cf
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit
+
+import requests
+
+import scraper
+
+HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVICE_PORT", "8080"))
+CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", "500"))
+# Hot channels (HOT_HITS requests within HOT_WINDOW seconds) are re-resolved in the
+# background once they are within REFRESH_AHEAD seconds of expiring.
+REFRESH_AHEAD = float(os.getenv("REFRESH_AHEAD", "600"))
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "30"))
+HOT_HITS = int(os.getenv("HOT_HITS", "2"))
+HOT_WINDOW = float(os.getenv("HOT_WINDOW", "3600"))
+# A channel whose resolve failed is not refreshed in the background again for this long.
+REFRESH_BACKOFF = float(os.getenv("REFRESH_BACKOFF", "900"))
+RESOLVE_TIMEOUT = float(os.getenv("RESOLVE_TIMEOUT", "180"))
+PROXY = os.getenv("SERVICE_PROXY", "1") == "1"
+PROXY_CONNECTIONS = int(os.getenv("SERVICE_PROXY_CONNECTIONS", "32"))
+CHUNK_SIZE = 64 * 1024
+PLAYLIST_TYPES = ("mpegurl", "m3u")
+
+URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]+)"')
+# Proxy URLs are signed so /proxy only fetches URLs this service handed out.
+_signing_key = secrets.token_bytes(32)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            sess = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=PROXY_CONNECTIONS, pool_maxsize=PROXY_CONNECTIONS)
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            _session = sess
+        return _session
+
+class TTLCache:
+    """
+    Channel id -> cache entry (scraper.make_cache_entry shape), bounded by `maxsize` with
+    least-recently-used eviction. Expired entries are never returned but stay listed until
+    evicted or refreshed, so the refresher can still see which channels were hot.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._hits: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def get(self, channel_id: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._hits.setdefault(channel_id, []).append(now)
+            entry = self._entries.get(channel_id)
+            if entry is None or not scraper.is_cache_entry_fresh(entry, now):
+                return None
+            self._entries.move_to_end(channel_id)
+            return entry
+
+    def peek(self, channel_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(channel_id)
+
+    def put(self, channel_id: str, entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[channel_id] = entry
+            self._entries.move_to_end(channel_id)
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self._hits.pop(evicted, None)
+
+    def invalidate(self, channel_id: str):
+        with self._lock:
+            self._entries.pop(channel_id, None)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def hot(self, now: float):
+        """Ids requested at least HOT_HITS times within HOT_WINDOW seconds."""
+        with self._lock:
+            for channel_id, hits in list(self._hits.items()):
+                hits[:] = [t for t in hits if now - t < HOT_WINDOW]
+                if not hits:
+                    del self._hits[channel_id]
+            return [channel_id for channel_id, hits in self._hits.items() if len(hits) >= HOT_HITS]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one; every caller gets its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, cf.Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True when another caller did the work."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = cf.Future()
+        if not leader:
+            return future.result(timeout), True
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result(), False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+class ChannelService:
+    def __init__(self, cache_size: int = CACHE_SIZE, resolver: Optional[Callable] = None):
+        self.cache = TTLCache(cache_size)
+        self.flights = SingleFlight()
+        self.stats: Counter = Counter()
+        self.names: Dict[str, str] = {}
+        self.logos: Dict[str, str] = {}
+        self.failed_at: Dict[str, float] = {}
+        self._resolver = resolver or (lambda channel: scraper.resolve_channel(channel, scraper.get_driver_pool()))
+        self._refresher = cf.ThreadPoolExecutor(max_workers=max(1, scraper.CONCURRENCY))
+        # Ids queued or running in the refresher, so a slow resolve is not queued again every tick.
+        self._pending: set = set()
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def load(self):
+        self.names = {channel_id: name for name, channel_id, _ in scraper.get_channels_list()}
+        payload = scraper.extract_payload_from_file("tvlogos.html")
+        raw_prefix = payload.get("initial_path", "")
+        for channel_id, name in self.names.items():
+            logo_path = scraper.pick_logo_path(name, payload)
+            self.logos[channel_id] = f"https://raw.githubusercontent.com{raw_prefix}{logo_path}" if logo_path else ""
+        now = time.time()
+        fresh = [(cid, e) for cid, e in scraper.load_url_cache().items() if scraper.is_cache_entry_fresh(e, now)]
+        # Soonest-expiring first so the LRU keeps the longest-lived entries if the cache is small.
+        for channel_id, entry in sorted(fresh, key=lambda item: item[1].get("expires_at", 0)):
+            self.cache.put(channel_id, entry)
+        print(f"[service] {len(self.names)} channels, {len(self.cache)} fresh cache entries loaded", flush=True)
+
+    def _resolve(self, channel_id: str) -> Optional[Dict[str, Any]]:
+        self.stats["resolves"] += 1
+        channel = (self.names.get(channel_id, channel_id), channel_id, None)
+        resolved = self._resolver(channel)
+        if not resolved or not resolved[2]:
+            self.stats["resolve_failures"] += 1
+            self.failed_at[channel_id] = time.time()
+            return None
+        self.failed_at.pop(channel_id, None)
+        entry = scraper.make_cache_entry(resolved[2])
+        self.cache.put(channel_id, entry)
+        scraper.store_resolved_entry(channel_id, entry)
+        return entry
+
+    def entry(self, channel_id: str, force: bool = False) -> Optional[Dict[str, Any]]:
+        if not force:
+            entry = self.cache.get(channel_id)
+            if entry:
+                self.stats["hits"] += 1
+                return entry
+        self.stats["misses"] += 1
+        entry, shared = self.flights.do(channel_id, lambda: self._resolve(channel_id), RESOLVE_TIMEOUT)
+        if shared:
+            self.stats["collapsed"] += 1
+        return entry
+
+    def refresh_due(self, now: Optional[float] = None) -> int:
+        """
+        Queues background resolves for hot channels whose entry is still valid but expires
+        within REFRESH_AHEAD. Channels without a usable entry are left to the next request,
+        and a failed resolve is not retried in the background for REFRESH_BACKOFF seconds.
+        """
+        now = now if now is not None else time.time()
+        due = 0
+        for channel_id in self.cache.hot(now):
+            entry = self.cache.peek(channel_id)
+            if entry is None or not scraper.is_cache_entry_fresh(entry, now):
+                continue
+            if now - self.failed_at.get(channel_id, 0) < REFRESH_BACKOFF:
+                continue
+            if entry.get("expires_at", 0) - now >= REFRESH_AHEAD:
+                continue
+            with self._pending_lock:
+                if channel_id in self._pending:
+                    continue
+                self._pending.add(channel_id)
+            self._refresher.submit(self._refresh, channel_id)
+            due += 1
+        self.stats["refreshes"] += due
+        return due
+
+    def _refresh(self, channel_id: str):
+        try:
+            # The entry may have been renewed (by a request or an earlier task) while this one was queued.
+            entry = self.cache.peek(channel_id)
+            if entry is not None and entry.get("expires_at", 0) - time.time() < REFRESH_AHEAD:
+                self.flights.do(channel_id, lambda: self._resolve(channel_id))
+            else:
+                self.stats["refreshes_skipped"] += 1
+        finally:
+            with self._pending_lock:
+                self._pending.discard(channel_id)
+
+    def run_refresher(self):
+        while not self._stop.wait(REFRESH_INTERVAL):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"[service] Background refresh failed: {e}", flush=True)
+
+    def close(self):
+        self._stop.set()
+        self._refresher.shutdown(wait=False)
+        scraper.get_driver_pool().close()
+        scraper.get_cache_store().close()
+
+def upstream_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    headers = {"User-Agent": entry.get("user_agent") or scraper.USER_AGENT}
+    if entry.get("referer"):
+        headers["Referer"] = entry["referer"]
+        headers["Origin"] = scraper._origin(entry["referer"])
+    return headers
+
+def sign(channel_id: str, url: str) -> str:
+    return hmac.new(_signing_key, f"{channel_id}\n{url}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+def proxy_url(service_url: str, channel_id: str, url: str) -> str:
+    return f"{service_url}/proxy/{channel_id}?" + urlencode({"url": url, "sig": sign(channel_id, url)})
+
+def rewrite_playlist(text: str, base_url: str, to_uri: Callable[[str], str] = lambda url: url) -> str:
+    """Resolves every URI in an HLS playlist against base_url and maps it through to_uri."""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            line = to_uri(urljoin(base_url, stripped))
+        elif "URI=" in line:
+            line = URI_ATTRIBUTE_RE.sub(lambda m: f'URI="{to_uri(urljoin(base_url, m.group(1)))}"', line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def is_playlist(resp: requests.Response) -> bool:
+    content_type = resp.headers.get("Content-Type", "").lower()
+    return any(t in content_type for t in PLAYLIST_TYPES) or urlsplit(resp.url).path.endswith(".m3u8")
+
+def build_playlist(service: ChannelService, base_url: str, direct: bool = False) -> str:
+    out = ["#EXTM3U"]
+    for channel_id, display_name in sorted(service.names.items(), key=lambda item: item[1]):
+        logo_url = service.logos.get(channel_id, "")
+        if not direct:
+            out.append(f'#EXTINF:-1 tvg-id="{channel_id}" tvg-name="{display_name}" tvg-logo="{logo_url}" '
+                       f'group-title="Daddylive", {display_name}')
+            out.append(f"{base_url}/channel/{channel_id}.m3u8")
+            continue
+        # Same entries scraper.py writes to out.m3u8, for players that honour #EXTVLCOPT.
+        entry = service.cache.peek(channel_id)
+        if not entry or not scraper.is_cache_entry_fresh(entry):
+            continue
+        for label, url in scraper.select_renditions(entry):
+            name = f"{display_name} ({label})" if label else display_name
+            out.append(f'#EXTINF:-1 tvg-id="{channel_id}" tvg-name="{name}" tvg-logo="{logo_url}" '
+                       f'group-title="Daddylive", {name}')
+            if entry.get("referer"):
+                out.append(f'#EXTVLCOPT:http-referrer={entry["referer"]}')
+            if entry.get("user_agent"):
+                out.append(f'#EXTVLCOPT:http-user-agent={entry["user_agent"]}')
+            out.append(url)
+    return "\n".join(out) + "\n"
+
+def make_handler(service: ChannelService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: str, content_type: str = "application/vnd.apple.mpegurl"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _service_url(self) -> str:
+            return f"http://{self.headers.get('Host') or f'{HOST}:{PORT}'}"
+
+        def _rewrite(self, channel_id: str, text: str, base_url: str) -> str:
+            if not PROXY:
+                return rewrite_playlist(text, base_url)
+            service_url = self._service_url()
+            return rewrite_playlist(text, base_url, lambda url: proxy_url(service_url, channel_id, url))
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            path = parts.path
+            if path == "/playlist.m3u8":
+                direct = parse_qs(parts.query).get("direct") == ["1"]
+                return self._send(200, build_playlist(service, self._service_url(), direct))
+            if path.startswith("/channel/") and path.endswith(".m3u8"):
+                return self._channel(path[len("/channel/"):-len(".m3u8")])
+            if path.startswith("/proxy/"):
+                query = parse_qs(parts.query)
+                return self._proxy(path[len("/proxy/"):], (query.get("url") or [""])[0], (query.get("sig") or [""])[0])
+            if path == "/health":
+                body = dict(service.stats, cached=len(service.cache), in_flight=service.flights.in_flight())
+                return self._send(200, json.dumps(body), "application/json")
+            self._send(404, "not found\n", "text/plain")
+
+        def _channel(self, channel_id: str):
+            # Only ids from the channel list: anything else would cost a full resolve.
+            if channel_id not in service.names:
+                return self._send(404, "unknown channel\n", "text/plain")
+            try:
+                # One retry with a forced re-resolve when the cached URL stopped working upstream.
+                for attempt in range(2):
+                    entry = service.entry(channel_id, force=attempt > 0)
+                    if not entry:
+                        return self._send(502, "could not resolve channel\n", "text/plain")
+                    resp = get_session().get(entry["url"], headers=upstream_headers(entry), timeout=scraper.HTTP_TIMEOUT)
+                    if resp.status_code == 200 and "#EXTM3U" in resp.text:
+                        return self._send(200, self._rewrite(channel_id, resp.text, resp.url or entry["url"]))
+                    service.cache.invalidate(channel_id)
+                    service.stats["upstream_failures"] += 1
+            except (requests.RequestException, cf.TimeoutError) as e:
+                print(f"[service] /channel/{channel_id}.m3u8 failed: {e}", flush=True)
+            self._send(502, "upstream unavailable\n", "text/plain")
+
+        def _proxy(self, channel_id: str, url: str, sig: str):
+            if not url or not hmac.compare_digest(sig, sign(channel_id, url)):
+                return self._send(403, "bad signature\n", "text/plain")
+            # Headers stay valid after the URL expires; a re-resolve would not change them.
+            entry = service.cache.peek(channel_id)
+            if entry is None:
+                return self._send(404, "channel not cached, reload /channel/{id}.m3u8\n", "text/plain")
+            # Identity encoding so the upstream Content-Length matches the bytes relayed.
+            headers = dict(upstream_headers(entry), **{"Accept-Encoding": "identity"})
+            if self.headers.get("Range"):
+                headers["Range"] = self.headers["Range"]
+            started = False
+            try:
+                with get_session().get(url, headers=headers, timeout=scraper.HTTP_TIMEOUT, stream=True) as resp:
+                    if resp.status_code == 200 and is_playlist(resp):
+                        return self._send(200, self._rewrite(channel_id, resp.text, resp.url))
+                    started = True
+                    self.send_response(resp.status_code)
+                    for name in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+                        if resp.headers.get(name):
+                            self.send_header(name, resp.headers[name])
+                    body = None
+                    if not resp.headers.get("Content-Length"):
+                        # Keep-alive needs a length: small bodies without one are buffered.
+                        body = resp.content
+                        self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if body is not None:
+                        self.wfile.write(body)
+                        return
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        self.wfile.write(chunk)
+            except requests.RequestException as e:
+                service.stats["proxy_failures"] += 1
+                print(f"[service] proxy {url} failed: {e}", flush=True)
+                if started:
+                    # Headers are already out; dropping the connection tells the player the body is short.
+                    self.close_connection = True
+                else:
+                    self._send(502, "upstream unavailable\n", "text/plain")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+def main():
+    service = ChannelService()
+    service.load()
+    threading.Thread(target=service.run_refresher, daemon=True).start()
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(service))
+    server.daemon_threads = True
+    print(f"[service] Listening on http://{HOST}:{PORT}/playlist.m3u8", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,29 @@
 # tvlogo.py (hardened)
 import json
-from bs4 import BeautifulSoup
+import math
+import re
+
+import cachestore
+import fetcher
+
+EMBEDDED_DATA_MARKER = 'data-target="react-app.embeddedData"'
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+def find_embedded_json(html):
+    """
+    Returns the text of GitHub's <script data-target="react-app.embeddedData"> tag
+    using plain string searches, without building a DOM for the whole page.
+    """
+    marker = html.find(EMBEDDED_DATA_MARKER)
+    if marker == -1:
+        return None
+    tag_start = html.rfind('<script', 0, marker)
+    body_start = html.find('>', marker)
+    body_end = html.find('</script>', body_start)
+    if tag_start == -1 or body_start == -1 or body_end == -1:
+        return None
+    return html[body_start + 1:body_end]
 
 def extract_payload_from_file(file_path):
     """
@@ -10,65 +33,116 @@ def extract_payload_from_file(file_path):
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             html = f.read()
+        return _payload_from_html(html)
+
+    except FileNotFoundError:
+        print(f'The file {file_path} does not exist.')
+        return {}
+    except Exception as e:
+        print(f'An error occurred: {e}')
+        return {}
+
+def _payload_from_html(html):
+    # GitHub embeds state here
+    script_text = find_embedded_json(html)
+    if not script_text:
+        print('Script tag with the payload not found.')
+        return {}
+
+    data = json.loads(script_text)
+    payload = data.get('payload', {})
+
+    # Derive a raw path like:
+    # https://raw.githubusercontent.com/<owner>/<repo>/<branch>/<path...>
+    # The original code tried to reconstruct from <react-app initial-path>,
+    # but we can be explicit:
+    # Find repo info and the current path in the payload.
+    repo = payload.get('repo', {}) or payload.get('repository', {})
+    owner_login = (repo.get('ownerLogin')
+                   or repo.get('owner', {}).get('login')
+                   or 'tv-logo')
+    repo_name = repo.get('name') or 'tv-logos'
+
+    # GitHub's tree payload usually has 'refInfo' or similar:
+    branch = (
+        payload.get('refInfo', {}).get('name') or
+        payload.get('ref', 'main') or
+        'main'
+    )
+
+    # Current directory path from the UI:
+    # payload['path'] or payload['currentPath'] depending on shape
+    current_path = (
+        payload.get('path') or
+        payload.get('currentPath') or
+        'countries/united-states'
+    )
+
+    # Normalize current_path (strip leading slashes)
+    current_path = current_path.lstrip('/')
+
+    # Compose initial_path to raw content (no /tree)
+    initial_path = f"/{owner_login}/{repo_name}/{branch}/"
+
+    # Store both the raw prefix and the original payload for items
+    payload['initial_path'] = initial_path
+    payload['current_path'] = current_path
+
+    return payload
+
+def load_payload(file_path, manifest_path=None):
+    """
+    Like extract_payload_from_file, but returns a compact payload (tree items with
+    name/path only, initial_path, current_path) cached in a manifest next to the
+    source file. The manifest is keyed by the source's SHA-256, so it is rebuilt
+    only when tvlogos.html actually changes.
+    """
+    manifest_path = manifest_path or file_path + MANIFEST_SUFFIX
+    # The fetcher already knows the hash of what it downloaded, so an unchanged
+    # tvlogos.html is not even read here.
+    digest = fetcher.content_hash(file_path)
+    if digest is None:
+        print(f'The file {file_path} does not exist.')
+        return {}
 
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # GitHub embeds state here
-        script_tag = soup.find('script', {
-            'type': 'application/json',
-            'data-target': 'react-app.embeddedData'
-        })
-        if not script_tag or not script_tag.string:
-            print('Script tag with the payload not found.')
-            return {}
-
-        data = json.loads(script_tag.string)
-        payload = data.get('payload', {})
-
-        # Derive a raw path like:
-        # https://raw.githubusercontent.com/<owner>/<repo>/<branch>/<path...>
-        # The original code tried to reconstruct from <react-app initial-path>,
-        # but we can be explicit:
-        # Find repo info and the current path in the payload.
-        repo = payload.get('repo', {}) or payload.get('repository', {})
-        owner_login = (repo.get('ownerLogin')
-                       or repo.get('owner', {}).get('login')
-                       or 'tv-logo')
-        repo_name = repo.get('name') or 'tv-logos'
-
-        # GitHub's tree payload usually has 'refInfo' or similar:
-        branch = (
-            payload.get('refInfo', {}).get('name') or
-            payload.get('ref', 'main') or
-            'main'
-        )
-
-        # Current directory path from the UI:
-        # payload['path'] or payload['currentPath'] depending on shape
-        current_path = (
-            payload.get('path') or
-            payload.get('currentPath') or
-            'countries/united-states'
-        )
-
-        # Normalize current_path (strip leading slashes)
-        current_path = current_path.lstrip('/')
-
-        # Compose initial_path to raw content (no /tree)
-        initial_path = f"/{owner_login}/{repo_name}/{branch}/"
-
-        # Store both the raw prefix and the original payload for items
-        payload['initial_path'] = initial_path
-        payload['current_path'] = current_path
-
-        return payload
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and manifest.get('source_sha256') == digest:
+            return manifest['payload']
+    except (OSError, ValueError, KeyError):
+        pass
 
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
     except FileNotFoundError:
         print(f'The file {file_path} does not exist.')
         return {}
+
+    try:
+        payload = _payload_from_html(raw.decode('utf-8'))
     except Exception as e:
         print(f'An error occurred: {e}')
         return {}
+    if not payload:
+        return {}
+
+    items = payload.get('tree', {}).get('items', [])
+    compact = {
+        'tree': {'items': [
+            {'name': item.get('name', ''), 'path': item.get('path', ''), 'contentType': item.get('contentType', '')}
+            for item in items
+        ]},
+        'initial_path': payload['initial_path'],
+        'current_path': payload['current_path'],
+    }
+    manifest = {'version': MANIFEST_VERSION, 'source_sha256': digest, 'payload': compact}
+    try:
+        cachestore.atomic_write_text(manifest_path, json.dumps(manifest, separators=(',', ':')))
+    except OSError as e:
+        print(f'Could not write logo manifest {manifest_path}: {e}')
+    return compact
 
 def search_tree_items(search_string, json_obj):
     """
@@ -92,3 +166,147 @@ def search_tree_items(search_string, json_obj):
             matches.append({'id': {'path': path}, 'source': ''})
 
     return matches
+
+# Tokens that say little about which logo is meant; they still count, but for less.
+WEAK_TOKENS = {'us', 'usa', 'uk', 'hd', 'fhd', 'uhd', 'hz', 'tv', 'network', 'channel', 'the', 'and', 'live'}
+WEAK_TOKEN_FACTOR = 0.25
+LOGO_EXTENSIONS = ('.png', '.svg', '.jpg')
+
+def tokenize_name(name):
+    """
+    Splits a channel or logo file name into normalized tokens:
+    'A&E USA' -> ['a', 'and', 'e', 'usa'], 'fox-sports-1-us.png' -> ['fox', 'sport', '1', 'us'].
+    """
+    return [_stem(word) for word in _split_words(name)]
+
+def _split_words(name):
+    name = name.lower().replace('&', ' and ')
+    for ext in LOGO_EXTENSIONS:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return re.findall(r'[a-z]+|[0-9]+', name)
+
+def _stem(word):
+    # Cheap stemming so 'sports' and 'sport' meet.
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class LogoIndex:
+    """
+    Inverted index over payload.tree.items[] logo files, built once per payload.
+    Lookups score candidates by IDF-weighted token overlap (weighted Jaccard), give
+    an exact stem match the win, and fall back to trigram similarity for tokens the
+    logo set has never seen.
+    """
+
+    def __init__(self, items, min_score=0.34, min_coverage=0.6):
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.paths = []
+        self.doc_tokens = []
+        self.stems = {}
+        self.compounds = {}
+        self.postings = {}
+        for item in items:
+            name = (item.get('name') or '')
+            if not name.lower().endswith(LOGO_EXTENSIONS):
+                continue
+            tokens = set(tokenize_name(name))
+            doc = len(self.paths)
+            self.paths.append(item.get('path') or name)
+            self.doc_tokens.append(tokens)
+            # Several files can share a stem ('cnbc-us', 'cnbc-hz-us'); the one with fewest extra tokens wins.
+            stem = frozenset(tokens - WEAK_TOKENS)
+            if stem not in self.stems or len(tokens) < len(self.doc_tokens[self.stems[stem]]):
+                self.stems[stem] = doc
+            # Channel names often glue the words of a file name together: 'TruTV' -> 'tru-tv-us.png'.
+            self.compounds.setdefault(_stem(''.join(w for w in _split_words(name) if w != 'us')), doc)
+            for token in tokens:
+                self.postings.setdefault(token, []).append(doc)
+
+        total = max(len(self.paths), 1)
+        self.idf = {}
+        for token, docs in self.postings.items():
+            weight = math.log(1 + total / len(docs))
+            self.idf[token] = weight * WEAK_TOKEN_FACTOR if token in WEAK_TOKENS else weight
+        self.default_idf = math.log(1 + total)
+
+        self.doc_weights = [sum(self.idf[t] for t in tokens) for tokens in self.doc_tokens]
+
+        self.trigrams = {}
+        for token in self.postings:
+            for gram in trigrams(token):
+                self.trigrams.setdefault(gram, set()).add(token)
+
+    @classmethod
+    def from_payload(cls, payload, **kwargs):
+        return cls(payload.get('tree', {}).get('items', []), **kwargs)
+
+    def _weight(self, token):
+        if token in self.idf:
+            return self.idf[token]
+        return self.default_idf * (WEAK_TOKEN_FACTOR if token in WEAK_TOKENS else 1.0)
+
+    def _expand(self, token):
+        """Maps a query token to (index token, similarity) pairs."""
+        if token in self.postings:
+            return [(token, 1.0)]
+        grams = trigrams(token)
+        counts = {}
+        for gram in grams:
+            for candidate in self.trigrams.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        matches = []
+        for candidate, shared in counts.items():
+            similarity = shared / (len(grams) + len(trigrams(candidate)) - shared)
+            if similarity >= 0.6:
+                matches.append((candidate, similarity))
+        return matches
+
+    def scored(self, display_name):
+        """Returns [(score, path)] for every candidate sharing a token with display_name, best first."""
+        query = set(tokenize_name(display_name))
+        if not query:
+            return []
+        query_weight = sum(self._weight(t) for t in query)
+        matched = {}
+        for token in query:
+            weight = self._weight(token)
+            if token not in self.postings and token in self.compounds:
+                matched.setdefault(self.compounds[token], {})[token] = weight
+                continue
+            for index_token, similarity in self._expand(token):
+                for doc in self.postings[index_token]:
+                    hits = matched.setdefault(doc, {})
+                    hits[token] = max(hits.get(token, 0.0), weight * similarity)
+
+        strong_tokens = query - WEAK_TOKENS
+        exact = self.stems.get(frozenset(strong_tokens))
+        strong_query = sum(self._weight(t) for t in query if t not in WEAK_TOKENS) or query_weight
+        results = []
+        for doc, hits in matched.items():
+            overlap = sum(hits.values())
+            strong_hit = sum(w for t, w in hits.items() if t not in WEAK_TOKENS) or overlap
+            if strong_hit / strong_query < self.min_coverage:
+                continue
+            # A bare number ('5 USA') is not enough evidence on its own.
+            if strong_tokens and all(t.isdigit() or t in WEAK_TOKENS for t in hits):
+                continue
+            score = overlap / (query_weight + self.doc_weights[doc] - overlap)
+            if doc == exact:
+                score += 1.0
+            results.append((score, self.paths[doc]))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return results
+
+    def lookup(self, display_name):
+        """Returns the best logo path for display_name, or '' when nothing scores high enough."""
+        results = self.scored(display_name)
+        if results and results[0][0] >= self.min_score:
+            return results[0][1]
+        return ''